@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+    Host-side throughput benchmarks for DebugBus, run against the emulator on
+    a pseudo-terminal (in a separate process, so that host CPU time is
+    measured on its own).
+
+    Usage: throughput.py [sizes=1,64,1024] [fifo=16,128] [baud=115200,1000000]
+                         [latency=200] [repeat=5] [min_time=0.2]
+                         [out=FILE] [compare=FILE] [tolerance=0.1]
+
+    For every combination of baud rate, FIFO size and transfer size, each of
+    read, write, read_peripheral and write_peripheral is timed, reporting
+    words/s, wire efficiency (against one 5-byte frame per word in each
+    direction) and host CPU time per word. Each operation is repeated at
+    least `repeat` times and for at least `min_time` seconds, and the best
+    run is reported, so that scheduling noise (which only ever slows a run
+    down) does not show up as a regression. Single-word read latency (p50 /
+    p99) is measured for every baud rate and FIFO size.
+
+    With out=FILE the results are also written as JSON. With compare=FILE the
+    results are compared against an earlier JSON file, and the exit status is
+    1 if any words/s figure dropped by more than `tolerance` (a fraction).
+"""
+import os
+import sys
+import time
+import json
+import platform
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from wbdbgbus import DebugBus, Emulator
+
+OPERATIONS = ["read", "write", "read_peripheral", "write_peripheral"]
+BITS_PER_BYTE = 10
+FRAME_BYTES = 5
+
+# Body of the emulator process: report the pty name, then run until told
+# to stop
+def run_emulator(conn, baud, fifo_size):
+    emulator = Emulator(baud=baud, fifo_depth=fifo_size)
+    conn.send(emulator.attach_pty())
+    conn.recv()
+    emulator.close()
+
+def start_emulator(baud, fifo_size):
+    conn, child = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=run_emulator, args=(child, baud, fifo_size), daemon=True)
+    process.start()
+    return process, conn, conn.recv()
+
+def stop_emulator(process, conn):
+    conn.send(None)
+    process.join()
+
+def run_operation(bus, op, n):
+    if op == "read":
+        bus.read(0, n)
+    elif op == "write":
+        bus.write(0, list(range(n)))
+    elif op == "read_peripheral":
+        bus.read_peripheral(0, n)
+    elif op == "write_peripheral":
+        bus.write_peripheral(0, list(range(n)))
+
+# Time `op` on `n` words at least `repeat` times and for at least
+# `min_time` seconds in total, keeping the best wall and CPU times
+def measure_throughput(bus, op, n, baud, repeat, min_time):
+    best_wall = None
+    best_cpu = None
+    runs = 0
+    total = 0.0
+
+    while (runs < repeat) or (total < min_time):
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        run_operation(bus, op, n)
+        cpu = time.process_time() - start_cpu
+        wall = time.perf_counter() - start_wall
+
+        best_wall = wall if best_wall is None else min(best_wall, wall)
+        best_cpu = cpu if best_cpu is None else min(best_cpu, cpu)
+        runs += 1
+        total += wall
+
+    words_per_second = n / best_wall
+    limit = baud / (FRAME_BYTES * BITS_PER_BYTE)
+
+    return {
+        "op": op,
+        "words": n,
+        "runs": runs,
+        "seconds": best_wall,
+        "words_per_second": words_per_second,
+        "wire_efficiency": words_per_second / limit,
+        "cpu_per_word": best_cpu / n,
+    }
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+def measure_latency(bus, count):
+    samples = []
+    for i in range(count):
+        start = time.perf_counter()
+        bus.read(0)
+        samples.append(time.perf_counter() - start)
+
+    return {
+        "samples": count,
+        "p50": percentile(samples, 50),
+        "p99": percentile(samples, 99),
+        "max": max(samples),
+    }
+
+def run(sizes, fifo_sizes, bauds, latency_samples, repeat, min_time):
+    results = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "runs": [],
+    }
+
+    for baud in bauds:
+        for fifo_size in fifo_sizes:
+            process, conn, port = start_emulator(baud, fifo_size)
+            try:
+                with DebugBus(port, baud, fifo_size=fifo_size, timeout=30) as bus:
+                    run = {
+                        "baud": baud,
+                        "fifo_size": fifo_size,
+                        "latency": measure_latency(bus, latency_samples),
+                        "throughput": [],
+                    }
+
+                    for n in sizes:
+                        for op in OPERATIONS:
+                            run["throughput"].append(measure_throughput(bus, op, n, baud, repeat, min_time))
+
+                    results["runs"].append(run)
+                    print_run(run)
+            finally:
+                stop_emulator(process, conn)
+
+    return results
+
+def print_run(run):
+    latency = run["latency"]
+    print("baud {} fifo {}: single-word latency p50 {:.3f} ms, p99 {:.3f} ms".format(
+        run["baud"], run["fifo_size"], latency["p50"] * 1e3, latency["p99"] * 1e3))
+
+    for r in run["throughput"]:
+        print("    {:<16} {:>7} words {:>10.0f} words/s {:>6.1f}% of wire {:>8.2f} us CPU/word (best of {})".format(
+            r["op"], r["words"], r["words_per_second"], r["wire_efficiency"] * 100, r["cpu_per_word"] * 1e6, r["runs"]))
+
+    sys.stdout.flush()
+
+# Key identifying a throughput measurement across result files
+def result_key(run, r):
+    return (run["baud"], run["fifo_size"], r["op"], r["words"])
+
+# Returns the descriptions of measurements which regressed beyond `tolerance`
+def compare(results, baseline, tolerance):
+    previous = {}
+    for run in baseline["runs"]:
+        for r in run["throughput"]:
+            previous[result_key(run, r)] = r["words_per_second"]
+
+    regressions = []
+    for run in results["runs"]:
+        for r in run["throughput"]:
+            key = result_key(run, r)
+            if key not in previous:
+                continue
+
+            ratio = r["words_per_second"] / previous[key]
+            if ratio < 1 - tolerance:
+                regressions.append("baud {} fifo {} {} {} words: {:.0f} -> {:.0f} words/s ({:+.1f}%)".format(
+                    key[0], key[1], key[2], key[3], previous[key], r["words_per_second"], (ratio - 1) * 100))
+
+    return regressions
+
+def main(argv):
+    options = {
+        "sizes": "1,64,1024",
+        "fifo": "16,128",
+        "baud": "115200,1000000",
+        "latency": "200",
+        "repeat": "5",
+        "min_time": "0.2",
+        "out": None,
+        "compare": None,
+        "tolerance": "0.1",
+    }
+
+    for arg in argv:
+        key, _, value = arg.partition("=")
+        if key not in options:
+            print(__doc__)
+            return 1
+        options[key] = value
+
+    sizes = [int(x, 0) for x in options["sizes"].split(",")]
+    fifo_sizes = [int(x, 0) for x in options["fifo"].split(",")]
+    bauds = [int(x, 0) for x in options["baud"].split(",")]
+
+    results = run(sizes, fifo_sizes, bauds, int(options["latency"]), int(options["repeat"]), float(options["min_time"]))
+
+    if options["out"] is not None:
+        with open(options["out"], "w") as f:
+            json.dump(results, f, indent=2)
+
+    if options["compare"] is not None:
+        with open(options["compare"]) as f:
+            baseline = json.load(f)
+
+        regressions = compare(results, baseline, float(options["tolerance"]))
+        for regression in regressions:
+            print("REGRESSION: " + regression)
+
+        if regressions:
+            return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -7,9 +7,12 @@ setup(
     description = "Host-side library for wishbone debug bus",
     url = "https://github.com/asinghani/wbdbgbus",
     packages = ["wbdbgbus"],
-    scripts = ["scripts/wb"],
+    scripts = ["scripts/wb", "scripts/wbdbgbus-server", "scripts/wbdbgbus-trace", "scripts/wbdbgbus-emulator"],
     install_requires = [
         "pyserial==3.4",
         "click==7.1.2"
-    ]
+    ],
+    extras_require = {
+        "sampler": ["numpy"]
+    }
 )
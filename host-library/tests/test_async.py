@@ -0,0 +1,55 @@
+import asyncio
+import pytest
+from wbdbgbus import AsyncDebugBus, Emulator, LoopbackTransport
+
+BAUD = 1000000
+FIFO_SIZE = 32
+
+def test_loopback():
+    async def run():
+        async with AsyncDebugBus("loopback://", BAUD, FIFO_SIZE, timeout=2) as bus:
+            bus.port.model.memory[0x10] = 1234
+            assert await bus.read(0x10) == [1234]
+
+            await bus.write(0x100, list(range(100)))
+            assert await bus.read(0x100, 100) == list(range(100))
+
+            # Concurrent transfers are pipelined together
+            results = await asyncio.gather(*[bus.read(0x100 + i, 10) for i in range(0, 100, 10)])
+            assert sum(results, []) == list(range(100))
+
+    asyncio.run(run())
+
+def test_loopback_interrupt():
+    async def run():
+        async with AsyncDebugBus("loopback://", BAUD, FIFO_SIZE, timeout=2) as bus:
+            await bus.write(0x20, [5, 6, 7])
+            bus.port.model.interrupt(2)
+            assert await bus.read(0x20, 3) == [5, 6, 7]
+            assert bus.poll_interrupts() == [False, True, False, False]
+
+    asyncio.run(run())
+
+def test_emulator_errors_and_timeout():
+    emulator = Emulator(baud=BAUD, fifo_depth=FIFO_SIZE, memory={0x10: 42}, errors={0x30},
+                        stalls={0x40: 25000000})
+
+    async def run():
+        async with AsyncDebugBus(LoopbackTransport(emulator), BAUD, FIFO_SIZE, timeout=0.3) as bus:
+            assert await bus.read(0x10) == [42]
+
+            with pytest.raises(RuntimeError):
+                await bus.read(0x30)
+            assert await bus.read(0x10) == [42]
+
+            # The stalled access is answered only after a second
+            with pytest.raises(TimeoutError):
+                await bus.read(0x40)
+
+            await bus.reset()
+            assert await bus.read(0x10, 2) == [42, 0]
+
+    try:
+        asyncio.run(run())
+    finally:
+        emulator.close()
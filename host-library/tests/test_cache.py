@@ -0,0 +1,57 @@
+import random
+from array import array
+from wbdbgbus import RegisterCache, VOLATILE, WRITE_THROUGH, CONSTANT
+
+def make_cache(seed):
+    rng = random.Random(seed)
+    cache = RegisterCache(max_size=1 << 16)
+    for i in range(20):
+        cache.add_region(rng.randrange(0, 200), rng.randrange(1, 50), rng.choice([VOLATILE, WRITE_THROUGH, CONSTANT]))
+
+    return cache
+
+def test_fill_follows_policies():
+    for seed in range(10):
+        cache = make_cache(seed)
+        values = [i if i % 7 else None for i in range(300)]
+        cache.fill(0, values)
+
+        expected = {a: v for a, v in enumerate(values) if (v is not None) and cache.cacheable(a)}
+        assert dict(cache.entries) == expected
+
+def test_fill_scans_regions_per_run():
+    cache = make_cache(0)
+    calls = []
+    policy = cache.policy
+    cache.policy = lambda a: calls.append(a) or policy(a)
+
+    cache.fill(0, list(range(100000)))
+    assert len(calls) <= 2 * len(cache.regions) + 1
+
+def test_written_follows_policies():
+    for seed in range(10):
+        cache = make_cache(seed)
+        cache.fill(0, [1] * 300)
+        before = dict(cache.entries)
+
+        values = [i if i % 5 else None for i in range(300)]
+        cache.written(0, values)
+
+        expected = dict(before)
+        for a, v in enumerate(values):
+            if v is None:
+                continue
+            if cache.policy(a) == WRITE_THROUGH:
+                expected[a] = v
+            else:
+                expected.pop(a, None)
+
+        assert dict(cache.entries) == expected
+
+def test_written_accepts_buffers():
+    cache = RegisterCache()
+    cache.add_region(0x100, 16, WRITE_THROUGH)
+
+    cache.written(0xF8, memoryview(array("I", range(32))))
+    assert cache.lookup(0x100, 16) == list(range(8, 24))
+    assert 0xF8 not in cache.entries
@@ -0,0 +1,42 @@
+from array import array
+from wbdbgbus import DebugBus, DeviceModel, LoopbackTransport
+
+BAUD = 1000000
+FIFO_SIZE = 32
+
+def open_bus():
+    model = DeviceModel(memory={i: i + 1 for i in range(100)})
+    return DebugBus(LoopbackTransport(model), BAUD, FIFO_SIZE)
+
+def words(path):
+    data = array("I")
+    with open(path, "rb") as f:
+        data.frombytes(f.read())
+    return data.tolist()
+
+def test_dump_replaces_larger_file(tmp_path):
+    path = str(tmp_path / "dump.bin")
+    with open(path, "wb") as f:
+        f.write(b"\xff" * 1000)
+
+    with open_bus() as bus:
+        bus.dump(0, 10, path)
+
+    assert words(path) == list(range(1, 11))
+
+def test_dump_resume_keeps_contents(tmp_path):
+    path = str(tmp_path / "dump.bin")
+    with open(path, "wb") as f:
+        f.write(bytes(20))
+
+    with open_bus() as bus:
+        bus.dump(0, 20, path, offset=5)
+
+    assert words(path) == [0] * 5 + list(range(6, 21))
+
+def test_load_round_trip(tmp_path):
+    path = str(tmp_path / "dump.bin")
+    with open_bus() as bus:
+        bus.dump(0, 50, path)
+        bus.load(path, 0x1000)
+        assert bus.read(0x1000, 50) == list(range(1, 51))
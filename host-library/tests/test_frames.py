@@ -0,0 +1,22 @@
+from wbdbgbus import DebugBus
+from wbdbgbus.utils import *
+
+BAUD = 1000000
+FIFO_SIZE = 32
+
+def test_encode_masks_words():
+    assert encode_frames(CMD_WRITE_REQ, [-1, 1 << 32 | 5]) == encode_frames(CMD_WRITE_REQ, [0xFFFFFFFF, 5])
+    assert create_instruction(CMD_WRITE_REQ, -2) == create_instruction(CMD_WRITE_REQ, 0xFFFFFFFE)
+
+def test_write_masks_words():
+    bus = DebugBus("loopback://", BAUD, FIFO_SIZE, timeout=2)
+
+    bus.write(0x10, [-1, (1 << 40) | 7])
+    assert bus.read(0x10, 2) == [0xFFFFFFFF, 7]
+
+    t = bus.batch()
+    t.write(0x20, [-2])
+    t.execute()
+    assert bus.read(0x20) == [0xFFFFFFFE]
+
+    bus.close()
@@ -0,0 +1,73 @@
+import pytest
+from wbdbgbus import DebugBus, RegisterCache, WRITE_THROUGH
+
+BAUD = 1000000
+FIFO_SIZE = 32
+
+@pytest.fixture
+def bus():
+    bus = DebugBus("loopback://", BAUD, FIFO_SIZE, timeout=2)
+    yield bus
+    bus.close()
+
+def test_modify_masks_bits(bus):
+    memory = bus.port.model.memory
+    memory[0x10] = 0x12345678
+
+    assert bus.modify(0x10, 0x0000FF00, 0xAAAAAAAA) == 0x12345678
+    assert memory[0x10] == 0x1234AA78
+
+    assert bus.set_bits(0x10, 0x80000001) == 0x1234AA78
+    assert memory[0x10] == 0x9234AA79
+
+    assert bus.clear_bits(0x10, 0x0000000F) == 0x9234AA79
+    assert memory[0x10] == 0x9234AA70
+
+def test_modify_wide_masks(bus):
+    memory = bus.port.model.memory
+    memory[0x10] = 0x12345678
+
+    # Only the low 32 bits of the mask and value count
+    bus.modify(0x10, 0xF00000000000000FF, 0x1000000000000000AB)
+    assert memory[0x10] == 0x123456AB
+
+    bus.modify(0x10, 0xF0000000, -1)
+    assert memory[0x10] == 0xF23456AB
+
+    bus.clear_bits(0x10, -1)
+    assert memory[0x10] == 0
+
+def test_modify_many_two_transfers(bus):
+    memory = bus.port.model.memory
+    memory.update({0x10: 0xFF, 0x11: 0xFF00, 0x30: 1})
+
+    transfers = bus.metrics.transfers
+    previous = bus.modify_many({0x10: (0x0F, 0x00), 0x11: (0xF000, 0x5000), 0x30: (0x2, 0x2)})
+
+    assert bus.metrics.transfers == transfers + 2
+    assert previous == {0x10: 0xFF, 0x11: 0xFF00, 0x30: 1}
+    assert (memory[0x10], memory[0x11], memory[0x30]) == (0xF0, 0x5F00, 3)
+
+def test_modify_many_cached(bus):
+    memory = bus.port.model.memory
+    bus.cache = RegisterCache()
+    bus.cache.add_region(0x100, 16, WRITE_THROUGH)
+    bus.write(0x100, [0x11, 0x22])
+    memory[0x20] = 0x44
+
+    # Cached words are read from the shadow, only 0x20 from the bus
+    transfers = bus.metrics.transfers
+    reads = bus.metrics.frames_sent["read"]
+    previous = bus.modify_many({0x100: (0xF0, 0x30), 0x101: (0x0F, 0x03), 0x20: (0xFF, 0x55)})
+
+    assert previous == {0x100: 0x11, 0x101: 0x22, 0x20: 0x44}
+    assert bus.metrics.frames_sent["read"] == reads + 1
+    assert bus.metrics.transfers == transfers + 2
+    assert (memory[0x100], memory[0x101], memory[0x20]) == (0x31, 0x23, 0x55)
+    assert bus.cache.lookup(0x100, 2) == [0x31, 0x23]
+
+    # With every word cached, only the write goes to the bus
+    transfers = bus.metrics.transfers
+    bus.set_bits(0x100, 0x100)
+    assert bus.metrics.transfers == transfers + 1
+    assert memory[0x100] == 0x131
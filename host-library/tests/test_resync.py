@@ -0,0 +1,177 @@
+import random
+import pytest
+from wbdbgbus import DebugBus, DeviceModel, Emulator, LoopbackTransport, FramingError
+
+BAUD = 1000000
+FIFO_SIZE = 32
+
+PIPE = 0x40
+
+"""
+    Emulator recording every write to the pipe register
+"""
+class PipeEmulator(Emulator):
+
+    def __init__(self, **kwargs):
+        Emulator.__init__(self, **kwargs)
+        self.pipe_writes = []
+
+    def bus_write(self, address, value):
+        Emulator.bus_write(self, address, value)
+        if address == PIPE:
+            self.pipe_writes.append(value)
+
+"""
+    Emulator losing bytes only on the way to the host (a byte lost on the way
+    to the device can turn into a misaligned write which is acknowledged)
+"""
+class ResponseLossEmulator(Emulator):
+
+    def receive(self, data):
+        with self.cond:
+            rate, self.loss_rate = self.loss_rate, 0.0
+            try:
+                Emulator.receive(self, data)
+            finally:
+                self.loss_rate = rate
+
+"""
+    Device which never answers
+"""
+class SilentModel(DeviceModel):
+
+    def receive(self, data):
+        pass
+
+"""
+    Device recording the address of every write
+"""
+class RecordingModel(DeviceModel):
+
+    def __init__(self, **kwargs):
+        DeviceModel.__init__(self, **kwargs)
+        self.writes = []
+
+    def bus_write(self, address, value):
+        DeviceModel.bus_write(self, address, value)
+        self.writes.append(address)
+
+"""
+    Loopback which loses the response byte at position `drop` on the way to
+    the host
+"""
+class DroppingTransport(LoopbackTransport):
+
+    def __init__(self, model, drop):
+        LoopbackTransport.__init__(self, model)
+        self.drop = drop
+        self.delivered = 0
+
+    def _deliver(self, data):
+        start = self.delivered
+        self.delivered += len(data)
+        if start <= self.drop < self.delivered:
+            data = data[0:self.drop - start] + data[self.drop - start + 1:]
+        LoopbackTransport._deliver(self, data)
+
+def open_bus(emulator):
+    bus = DebugBus(LoopbackTransport(emulator), BAUD, FIFO_SIZE, timeout=0.5)
+    bus.resync_on_timeout = True
+    bus.resync_attempts = 20
+    return bus
+
+def test_incrementing_read_recovers():
+    rng = random.Random(2)
+    memory = {i: rng.getrandbits(32) for i in range(4000)}
+    emulator = Emulator(baud=BAUD, fifo_depth=FIFO_SIZE, memory=dict(memory), loss_rate=0.0001, seed=1)
+    bus = open_bus(emulator)
+
+    try:
+        assert bus.read(0, 4000) == [memory[i] for i in range(4000)]
+        assert emulator.lost_bytes > 0
+        assert bus.metrics.resyncs > 0
+    finally:
+        bus.close()
+        emulator.close()
+
+def test_incrementing_write_recovers():
+    rng = random.Random(3)
+    data = [rng.getrandbits(32) for i in range(3000)]
+    emulator = ResponseLossEmulator(baud=BAUD, fifo_depth=FIFO_SIZE, loss_rate=0.0002, seed=2)
+    bus = open_bus(emulator)
+
+    try:
+        bus.write(0x1000, data)
+        assert [emulator.memory.get(0x1000 + i) for i in range(3000)] == data
+        assert bus.metrics.resyncs > 0
+    finally:
+        bus.close()
+        emulator.close()
+
+def test_pipe_write_raises():
+    emulator = PipeEmulator(baud=BAUD, fifo_depth=FIFO_SIZE, loss_rate=0.0002, seed=1)
+    bus = open_bus(emulator)
+
+    try:
+        with pytest.raises((FramingError, TimeoutError)):
+            bus.write_peripheral(PIPE, list(range(1, 3001)))
+
+        # Nothing was written to the pipe twice
+        written = [value for value in emulator.pipe_writes if 1 <= value <= 3000]
+        assert written == sorted(set(written))
+
+        # The bus is usable again
+        emulator.loss_rate = 0.0
+        bus.write(0x10, [1, 2, 3])
+        assert bus.read(0x10, 3) == [1, 2, 3]
+    finally:
+        bus.close()
+        emulator.close()
+
+def test_pipe_read_raises():
+    emulator = Emulator(baud=BAUD, fifo_depth=FIFO_SIZE, loss_rate=0.0002, seed=1)
+    bus = open_bus(emulator)
+
+    try:
+        with pytest.raises((FramingError, TimeoutError)):
+            bus.read_peripheral(PIPE, 3000)
+    finally:
+        bus.close()
+        emulator.close()
+
+def test_timeout_raises_by_default():
+    bus = DebugBus(LoopbackTransport(SilentModel()), BAUD, FIFO_SIZE, timeout=0.2)
+
+    with pytest.raises(TimeoutError):
+        bus.read(0, 10)
+    assert bus.metrics.resyncs == 0
+    bus.close()
+
+def test_answered_writes_not_repeated():
+    model = RecordingModel()
+    bus = DebugBus(DroppingTransport(model, drop=12 * 5 + 2), BAUD, 8, timeout=0.5)
+    bus.drop_time = 0.01
+
+    try:
+        bus.write(0x100, list(range(40)))
+        assert bus.metrics.resyncs == 1
+        assert [model.memory.get(0x100 + i) for i in range(40)] == list(range(40))
+
+        # The writes answered before the lost byte (up to 0x10A) were not
+        # executed again
+        assert sorted(model.writes[0:11]) == list(range(0x100, 0x10B))
+        assert all(address >= 0x10B for address in model.writes[11:])
+    finally:
+        bus.close()
+
+def test_read_repeats_window_when_enabled():
+    model = DeviceModel(memory={0x100 + i: i for i in range(40)})
+    bus = DebugBus(DroppingTransport(model, drop=12 * 5 + 2), BAUD, 8, timeout=0.5)
+    bus.drop_time = 0.01
+    bus.resync_repeat_window = True
+
+    try:
+        assert bus.read(0x100, 40) == list(range(40))
+        assert bus.metrics.resyncs == 1
+    finally:
+        bus.close()
@@ -0,0 +1,104 @@
+import os
+import tempfile
+import pytest
+from wbdbgbus import DebugBus, DeviceModel, LoopbackTransport, Emulator
+
+np = pytest.importorskip("numpy")
+
+BAUD = 1000000
+FIFO_SIZE = 32
+
+COUNTER = 0x10
+CONSTANT = 0x11
+
+"""
+    Device whose counter register counts its own reads (so row k of a
+    sampler reads k)
+"""
+class CounterModel(DeviceModel):
+
+    def __init__(self):
+        DeviceModel.__init__(self, memory={CONSTANT: 7})
+        self.count = 0
+
+    def bus_read(self, address):
+        if address == COUNTER:
+            self.count += 1
+            return self.count - 1
+
+        return DeviceModel.bus_read(self, address)
+
+@pytest.fixture
+def bus():
+    bus = DebugBus(LoopbackTransport(CounterModel()), BAUD, FIFO_SIZE, timeout=2)
+    yield bus
+    bus.close()
+
+def run_until(sampler, rows):
+    sampler.start()
+    while sampler.count < rows:
+        assert sampler.running
+    sampler.stop()
+
+def test_wraparound_keeps_latest_rows(bus):
+    sampler = bus.sampler([COUNTER, CONSTANT], capacity=16)
+    run_until(sampler, 100)
+
+    times, values = sampler.data()
+    assert len(sampler) == 16
+    assert values.shape == (16, 2)
+
+    # The latest rows, oldest first
+    assert list(values[:, 0]) == list(range(sampler.count - 16, sampler.count))
+    assert list(values[:, 1]) == [7] * 16
+    assert np.all(np.diff(times) >= 0)
+    assert times[0] >= 0
+    assert sampler.trigger_index() is None
+
+def test_trigger_with_pretrigger(bus):
+    sampler = bus.sampler([COUNTER], capacity=32, trigger=(COUNTER, 0xFF, 20), pretrigger=8)
+    sampler.start()
+    assert sampler.wait(timeout=5)
+
+    times, values = sampler.data()
+    assert list(values[:, 0]) == list(range(12, 44))
+    assert sampler.trigger_index() == 8
+    assert not sampler.running
+
+def test_trigger_after_wraparound(bus):
+    sampler = bus.sampler([COUNTER], capacity=16, trigger=lambda row: row[0] == 100, pretrigger=4)
+    sampler.start()
+    assert sampler.wait(timeout=5)
+
+    times, values = sampler.data()
+    assert list(values[:, 0]) == list(range(96, 112))
+    assert sampler.trigger_index() == 4
+    assert values[sampler.trigger_index(), 0] == 100
+
+def test_save_round_trip(bus):
+    sampler = bus.sampler([COUNTER, CONSTANT], capacity=16)
+    run_until(sampler, 40)
+
+    path = os.path.join(tempfile.mkdtemp(), "samples.npy")
+    sampler.save(path)
+    rows = np.load(path)
+
+    times, values = sampler.data()
+    assert np.array_equal(rows["time"], times)
+    assert np.array_equal(rows["values"], values)
+
+def test_timestamps_follow_link_rate():
+    emulator = Emulator(baud=115200, fifo_depth=FIFO_SIZE)
+    bus = DebugBus(LoopbackTransport(emulator), 115200, FIFO_SIZE, timeout=2)
+
+    try:
+        sampler = bus.sampler([COUNTER], capacity=1024)
+        run_until(sampler, 500)
+
+        # Rows arrive back-to-back, one address set and one read each
+        times, values = sampler.data()
+        spacing = np.median(np.diff(times))
+        assert spacing == pytest.approx(sampler.row_frames * sampler.frame_time, rel=0.2)
+    finally:
+        bus.close()
+        emulator.close()
@@ -0,0 +1,144 @@
+import os
+import socket
+import tempfile
+import threading
+import time
+import pytest
+from wbdbgbus import DebugBus, BusServer, RemoteDebugBus, Emulator, LoopbackTransport
+from wbdbgbus.utils import *
+from wbdbgbus.server import REQUEST_HEADER, REPLY_HEADER, MSG_TRANSFER, STATUS_OK, STATUS_BUS_ERROR
+
+BAUD = 1000000
+FIFO_SIZE = 32
+
+def make_server():
+    path = os.path.join(tempfile.mkdtemp(), "bus.sock")
+    bus = DebugBus("loopback://", BAUD, FIFO_SIZE, timeout=2)
+    return BusServer(bus, path), bus
+
+def recv_reply(sock):
+    header = sock.recv(REPLY_HEADER.size, socket.MSG_WAITALL)
+    status, n = REPLY_HEADER.unpack(header)
+    size = n * FRAME_SIZE if status == STATUS_OK else n
+    return status, sock.recv(size, socket.MSG_WAITALL) if size > 0 else b""
+
+def test_bus_error_fails_only_its_client():
+    server, bus = make_server()
+    bus.port.model.memory[0x10] = 1234
+    bus.port.model.errors.add(0x20)
+
+    clients = []
+    for i in range(2):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(server.socket_path)
+        server._accept()
+        clients.append(sock)
+
+    # Queue one read from each client, so both run in the same round
+    for sock, address in zip(clients, [0x10, 0x20]):
+        frames = encode_frames(CMD_SET_ADDR_INC, [address]) + encode_frames(CMD_READ_REQ, [0])
+        sock.sendall(REQUEST_HEADER.pack(MSG_TRANSFER, 0, 2) + frames)
+
+    for client in list(server.clients):
+        server._read(client)
+
+    server._run_round()
+
+    status, payload = recv_reply(clients[0])
+    assert status == STATUS_OK
+    assert decode_frames(payload)[1][1] == 1234
+
+    status, payload = recv_reply(clients[1])
+    assert status == STATUS_BUS_ERROR
+
+    for sock in clients:
+        sock.close()
+    server.close()
+
+def test_interrupts_since_connect():
+    server, bus = make_server()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    try:
+        bus.port.model.interrupt(1)
+        remote = RemoteDebugBus(server.socket_path, timeout=2)
+
+        # Interrupts before connecting are not reported, later ones are
+        # (even if no poll happened in between)
+        bus.port.model.interrupt(2)
+        assert remote.read(0x10) == [0]
+        assert remote.poll_interrupts() == [False, True, False, False]
+
+        remote.close()
+    finally:
+        server.close()
+        thread.join()
+
+def test_noise_on_idle_line():
+    server, bus = make_server()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    try:
+        bus.port.model.memory[0x10] = 1234
+        remote = RemoteDebugBus(server.socket_path, timeout=2)
+
+        # Invalid response frame while the bus is idle
+        bus.port.model.transmit(bytes([0xFF] * FRAME_SIZE))
+        with pytest.raises(ConnectionError):
+            remote.poll_interrupts()
+
+        # The server survives and serves later requests
+        assert thread.is_alive()
+        assert remote.read(0x10) == [1234]
+        assert remote.poll_interrupts() == [False, False, False, False]
+
+        remote.close()
+    finally:
+        server.close()
+        thread.join()
+
+def test_streams_interleave_with_other_clients():
+    emulator = Emulator(baud=BAUD, fifo_depth=FIFO_SIZE, memory={0x20: 99})
+    path = os.path.join(tempfile.mkdtemp(), "bus.sock")
+    bus = DebugBus(LoopbackTransport(emulator), BAUD, FIFO_SIZE, timeout=2)
+    server = BusServer(bus, path)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    try:
+        streaming = RemoteDebugBus(path, timeout=5)
+        other = RemoteDebugBus(path, timeout=5)
+
+        def wait():
+            with pytest.raises(TimeoutError):
+                streaming.wait_until(0x10, 1, 1, timeout=1, interval=0.05)
+
+        waiter = threading.Thread(target=wait)
+        waiter.start()
+        time.sleep(0.2)
+
+        # Served between the requests of the other client's stream
+        start = time.monotonic()
+        assert other.read(0x20) == [99]
+        assert other.read(0x100, 2000) == [0] * 2000
+        assert time.monotonic() - start < 0.3
+        waiter.join()
+
+        # Streams resume at the right position after other clients' transfers
+        writer = threading.Thread(target=streaming.write, args=(0x1000, list(range(20000))))
+        writer.start()
+        while writer.is_alive():
+            assert other.read(0x20) == [99]
+        writer.join()
+
+        assert [emulator.memory.get(0x1000 + i) for i in range(20000)] == list(range(20000))
+        assert emulator.memory.get(0x1000 + 20000) is None
+
+        streaming.close()
+        other.close()
+    finally:
+        server.close()
+        thread.join()
+        emulator.close()
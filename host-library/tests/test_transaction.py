@@ -0,0 +1,94 @@
+import pytest
+from wbdbgbus import DebugBus, RegisterCache, WRITE_THROUGH
+
+BAUD = 1000000
+FIFO_SIZE = 32
+
+@pytest.fixture
+def bus():
+    bus = DebugBus("loopback://", BAUD, FIFO_SIZE, timeout=2)
+    yield bus
+    bus.close()
+
+def address_sets(bus):
+    return bus.metrics.frames_sent["set_addr_inc"], bus.metrics.frames_sent["set_addr"]
+
+def test_adjacent_ops_share_address_set(bus):
+    with bus.batch() as t:
+        t.write(0x10, [1, 2])
+        t.write(0x12, 3)
+        first = t.read(0x13, 2)
+        second = t.read(0x15)
+
+    assert address_sets(bus) == (1, 0)
+    assert first.value == [0, 0]
+    assert second.value == [0]
+    assert [bus.port.model.memory.get(a) for a in range(0x10, 0x13)] == [1, 2, 3]
+
+def test_non_adjacent_ops_set_address(bus):
+    bus.port.model.memory.update({0x20: 5, 0x30: 6})
+
+    with bus.batch() as t:
+        t.write(0x10, [1])
+        a = t.read(0x20)
+        b = t.read(0x30)
+        c = t.read(0x10)
+
+    assert address_sets(bus) == (4, 0)
+    assert (a.value, b.value, c.value) == ([5], [6], [1])
+
+def test_holes_keep_address(bus):
+    bus.port.model.memory[0x11] = 7
+
+    with bus.batch() as t:
+        t.write(0x10, [1, None, 3])
+        t.write(0x13, [4])
+
+    assert address_sets(bus) == (1, 0)
+    assert [bus.port.model.memory.get(a) for a in range(0x10, 0x14)] == [1, 7, 3, 4]
+
+def test_peripheral_ops_interleaved(bus):
+    bus.port.model.memory[0x41] = 9
+
+    with bus.batch() as t:
+        t.write_peripheral(0x40, [1, 2])
+        t.write_peripheral(0x40, 3)     # Same pipe, no address set
+        p = t.read_peripheral(0x40, 2)
+        a = t.read(0x40)                # Same address, but incrementing
+        b = t.read(0x41)                # Follows on from the read above
+        q = t.read_peripheral(0x41)     # Non-incrementing again
+
+    assert address_sets(bus) == (1, 2)
+    assert p.value == [3, 3]
+    assert a.value == [3]
+    assert b.value == [9]
+    assert q.value == [9]
+
+def test_results_before_execute(bus):
+    t = bus.batch()
+    result = t.read(0x10)
+
+    with pytest.raises(RuntimeError):
+        result.value
+
+    t.execute()
+    assert result.value == [0]
+
+def test_execute_updates_cache(bus):
+    bus.cache = RegisterCache()
+    bus.cache.add_region(0x100, 16, WRITE_THROUGH)
+    bus.cache.fill(0x108, [99])
+    bus.port.model.memory[0x104] = 4
+
+    with bus.batch() as t:
+        t.write(0x100, [1, None, 3])
+        t.read(0x104)
+        t.write_peripheral(0x108, [5, 6])
+
+    assert bus.cache.entries == {0x100: 1, 0x102: 3, 0x104: 4}
+
+    # Served from the cache without touching the bus
+    sent = bus.metrics.frames_sent["read"]
+    assert bus.read(0x100) == [1]
+    assert bus.read(0x104) == [4]
+    assert bus.metrics.frames_sent["read"] == sent
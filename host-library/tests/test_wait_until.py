@@ -0,0 +1,57 @@
+import time
+import threading
+import pytest
+from wbdbgbus import DebugBus, DeviceModel, Emulator, LoopbackTransport
+
+BAUD = 1000000
+FIFO_SIZE = 32
+
+"""
+    Device which never answers
+"""
+class SilentModel(DeviceModel):
+
+    def receive(self, data):
+        pass
+
+def test_match():
+    emulator = Emulator(baud=BAUD, fifo_depth=FIFO_SIZE, memory={0x10: 0})
+    bus = DebugBus(LoopbackTransport(emulator), BAUD, FIFO_SIZE)
+    threading.Timer(0.1, lambda: emulator.memory.__setitem__(0x10, 0x5)).start()
+
+    try:
+        sample, count, elapsed = bus.wait_until(0x10, 0x4, 0x4, timeout=2)
+        assert sample == 0x5
+        assert count > 1
+        assert 0.1 <= elapsed < 1
+
+        # Reads still in flight were discarded
+        assert bus.read(0x10, 2) == [0x5, 0]
+    finally:
+        bus.close()
+        emulator.close()
+
+@pytest.mark.parametrize("interval", [0, 1])
+def test_timeout(interval):
+    emulator = Emulator(baud=BAUD, fifo_depth=FIFO_SIZE)
+    bus = DebugBus(LoopbackTransport(emulator), BAUD, FIFO_SIZE)
+
+    try:
+        start = time.monotonic()
+        with pytest.raises(TimeoutError):
+            bus.wait_until(0x10, 0x1, 0x1, timeout=0.2, interval=interval)
+        assert time.monotonic() - start < 0.5
+
+        assert bus.read(0x10, 2) == [0, 0]
+    finally:
+        bus.close()
+        emulator.close()
+
+def test_timeout_without_device():
+    bus = DebugBus(LoopbackTransport(SilentModel()), BAUD, FIFO_SIZE)
+
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        bus.wait_until(0x10, 0x1, 0x1, timeout=0.2)
+    assert time.monotonic() - start < 0.5
+    bus.close()
@@ -1,3 +1,17 @@
 from .debug_bus import DebugBus
+from .async_debug_bus import AsyncDebugBus
 
 
+from .transaction import Transaction, Result
+from .sampler import Sampler
+from .planner import CostModel, WritePlan
+from .metrics import Metrics, Histogram, TransferRecord
+from .tuning import Tuner
+from .trace import TraceRecorder, ReplayPort, read_trace, decode_trace
+from .transport import TcpTransport, LoopbackTransport, open_transport
+from .model import DeviceModel, WishboneError
+from .utils import FramingError
+from .emulator import Emulator
+from .cache import RegisterCache, VOLATILE, WRITE_THROUGH, CONSTANT
+from .server import BusServer
+from .remote import RemoteDebugBus
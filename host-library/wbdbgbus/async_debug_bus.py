@@ -0,0 +1,345 @@
+import asyncio
+from array import array
+from collections import deque
+from .utils import *
+from .ring_buffer import RingBuffer
+from .transport import open_transport
+
+"""
+    A queued command stream and the future its responses resolve.
+"""
+class _Transaction:
+
+    def __init__(self, cmds, words, future):
+        self.stream = memoryview(encode_frames(cmds, words))
+        self.n = len(cmds)
+        self.sent = 0
+        self.opcodes = array("B")
+        self.data = array("I")
+        self.bus_error = False
+        self.future = future
+
+    def resolve(self):
+        if self.future.done():
+            # Caller gave up (timeout / cancellation) before completion
+            return
+
+        if self.bus_error:
+            self.future.set_exception(RuntimeError("Bus error received"))
+        else:
+            self.future.set_result((self.opcodes, self.data))
+
+"""
+    asyncio wrapper for UART debug bus. Transactions from any number of
+    coroutines are queued in FIFO order and pipelined through the device's
+    command FIFO, and a reader callback registered on the event loop resolves
+    each transaction's future as its responses arrive. Requires a port with a
+    pollable file descriptor (i.e. a POSIX serial device).
+"""
+class AsyncDebugBus:
+
+    def __init__(self, serial_port, baud, fifo_size, timeout=0):
+        # Maximum number of ops that can be in-pipeline at once
+        self.max_buf = (fifo_size - 2) if fifo_size > 2 else fifo_size
+        assert self.max_buf > 0
+
+        self.port = self._open_port(serial_port, baud)
+        self.timeout = timeout
+
+        self.interrupts = [False, False, False, False]
+        self.interrupt_queues = []
+
+        self.recv_buffer = RingBuffer()
+
+        # Transactions with frames still to send / responses still to receive
+        self.send_queue = deque()
+        self.recv_queue = deque()
+        self.in_flight = 0
+
+        self.reset_futures = []
+        self.loop = None
+
+    def _open_port(self, serial_port, baud):
+        # Already-open port-like object (e.g. a transport)
+        if not isinstance(serial_port, str):
+            serial_port.timeout = 0
+            return serial_port
+
+        return open_transport(serial_port, baud)
+
+    # Register the reader with the running event loop (on first use)
+    def _attach(self):
+        if self.loop is None:
+            try:
+                fd = self.port.fileno()
+            except (AttributeError, OSError):
+                raise ValueError("AsyncDebugBus requires a transport with a pollable file descriptor")
+
+            self.loop = asyncio.get_running_loop()
+            self.loop.add_reader(fd, self._on_readable)
+
+    # Send as many queued frames as the window allows, in a single write
+    def _pump(self):
+        chunks = []
+        while self.send_queue and self.in_flight < self.max_buf:
+            t = self.send_queue[0]
+            count = min(self.max_buf - self.in_flight, t.n - t.sent)
+            chunks.append(t.stream[t.sent * FRAME_SIZE:(t.sent + count) * FRAME_SIZE])
+            t.sent += count
+            self.in_flight += count
+
+            if t.sent == t.n:
+                self.send_queue.popleft()
+                self.recv_queue.append(t)
+
+        if chunks:
+            self.port.write(b"".join(chunks))
+
+    # The transaction which the next response belongs to, if any
+    def _head(self):
+        if self.recv_queue:
+            return self.recv_queue[0]
+        elif self.send_queue and self.send_queue[0].sent > 0:
+            return self.send_queue[0]
+        else:
+            return None
+
+    # Hand `count` ordinary responses, starting at `start`, to the
+    # transactions awaiting them
+    def _dispatch(self, opcodes, data, start, count):
+        while count > 0:
+            t = self._head()
+            if t is None:
+                # Stale response (e.g. from before a reset)
+                return
+
+            take = min(count, t.sent - len(t.opcodes))
+            if take <= 0:
+                return
+
+            t.opcodes.extend(opcodes[start:start + take])
+            t.data.extend(data[start:start + take])
+            self.in_flight -= take
+            start += take
+            count -= take
+
+            if len(t.opcodes) == t.n:
+                self.recv_queue.popleft()
+                t.resolve()
+
+    def _on_readable(self):
+        self.recv_buffer.write(self.port.read(10000))
+
+        if len(self.recv_buffer) >= FRAME_SIZE:
+            opcodes, data = self.recv_buffer.pop_frames()
+
+            if not any((x in opcodes) for x in RESP_SPECIAL + [RESP_BUS_RESET]):
+                self._dispatch(opcodes, data, 0, len(opcodes))
+
+            else:
+                for i, inst in enumerate(opcodes):
+                    if inst in RESP_INTERRUPT_ALL:
+                        self._on_interrupt(RESP_INTERRUPT_ALL.index(inst))
+
+                    elif inst == RESP_BUS_RESET:
+                        self._on_reset()
+
+                    else:
+                        # A bus error stands in for the failed command's ack
+                        if inst == RESP_BUS_ERROR and self._head() is not None:
+                            self._head().bus_error = True
+                        self._dispatch(opcodes, data, i, 1)
+
+        self._pump()
+
+    def _on_interrupt(self, index):
+        self.interrupts[index] = True
+        for queue in self.interrupt_queues:
+            queue.put_nowait(index + 1)
+
+    # The device discards both FIFOs on reset, so anything still in flight
+    # will never be answered
+    def _on_reset(self):
+        for t in list(self.recv_queue):
+            if not t.future.done():
+                t.future.set_exception(ConnectionResetError("Bus was reset"))
+        self.recv_queue.clear()
+
+        # A partially-sent transaction cannot be resumed either
+        if self.send_queue and self.send_queue[0].sent > 0:
+            t = self.send_queue.popleft()
+            if not t.future.done():
+                t.future.set_exception(ConnectionResetError("Bus was reset"))
+
+        self.in_flight = 0
+
+        for future in self.reset_futures:
+            if not future.done():
+                future.set_result(None)
+        self.reset_futures = []
+
+    # Queue a command stream and wait for its responses
+    # Returns (opcode_array, data_array)
+    async def _transfer(self, cmds, words):
+        self._attach()
+        future = self.loop.create_future()
+        self.send_queue.append(_Transaction(cmds, words, future))
+        self._pump()
+
+        if self.timeout == 0:
+            return await future
+
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError("Remote device not responding")
+
+    async def read(self, address, n=1, _increment=True):
+        """
+            Read `n` contiguous 32-bit words starting at `address`. Returns a list of integer values with length `n`. For reading multiple values from the same address (for peripherals which use a single register as a pipe), use read_peripheral().
+
+            Arguments:
+                address (int): The base address to read from.
+                n (int): The number of values to read starting at the given address.
+        """
+
+        opcodes, data = await self._transfer(*read_commands(address, n, _increment))
+
+        # Remove address-acknowledge
+        assert opcodes[0] == RESP_ADDR_ACK
+        assert opcodes.count(RESP_READ_RESP) == n
+
+        return data[1:].tolist()
+
+    async def read_peripheral(self, address, n=1):
+        """
+            Read `n` 32-bit words, all from `address`. This should be used for peripherals which use a single register as a pipe.
+
+            Arguments:
+                address (int): The singular address to read from.
+                n (int): The number of values to read from the given address.
+        """
+
+        return await self.read(address, n=n, _increment=False)
+
+    async def write(self, address, data, verify=False, _increment=True):
+        """
+            Write `data` into contiguous 32-bit words starting at `address`. `None` values in the data array will not be written. For writing multiple values to the same address (for peripherals which use a single register as a pipe), use write_peripheral().
+
+            Arguments:
+                address (int): The base address to write to.
+                data (list[int] OR int): The data to write.
+                verify (bool): Whether to read-back and verify the data after writing it.
+        """
+
+        # Check data format
+        if isinstance(data, int):
+            data = [data]
+
+        # Use read req to increment address w/o writing
+        if None in data:
+            assert _increment
+
+        opcodes = (await self._transfer(*write_commands(address, data, _increment)))[0]
+
+        # Remove address-acknowledge
+        assert opcodes[0] == RESP_ADDR_ACK
+        for i, resp in enumerate(opcodes[1:]):
+            if data[i] is None:
+                assert resp == RESP_READ_RESP
+            else:
+                assert resp == RESP_WRITE_ACK
+
+        # Verify that correct data was written
+        if verify and _increment:
+            data_read = await self.read(address, n=len(data), _increment=True)
+
+            for i in range(len(data)):
+                assert (data_read[i] == data[i]) or (data[i] is None)
+
+    async def write_peripheral(self, address, data):
+        """
+            Write all values in `data` to `address`. This should be used for peripherals which use a single register as a pipe.
+
+            Arguments:
+                address (int): The singular address to write to.
+                data (list[int]): The data to write to the address.
+        """
+
+        await self.write(address, data, verify=False, _increment=False)
+
+    async def reset(self):
+        """
+            Forcibly reset the bus. Completes once the bus-reset is acknowledged. Transactions which were in flight at the time of the reset fail with ConnectionResetError.
+        """
+        self._attach()
+        future = self.loop.create_future()
+        self.reset_futures.append(future)
+
+        # Bypasses the command FIFO on the device, so no credit is needed
+        self.port.write(encode_frames(CMD_BUS_RESET, [0]))
+
+        if self.timeout == 0:
+            await future
+        else:
+            try:
+                await asyncio.wait_for(future, self.timeout)
+            except asyncio.TimeoutError:
+                raise TimeoutError("Remote device not responding")
+
+        self._pump()
+
+    async def interrupt_stream(self):
+        """
+            Asynchronous iterator over received interrupts. Yields the interrupt number (1-4) of each interrupt in the order they arrive.
+        """
+        self._attach()
+        queue = asyncio.Queue()
+        self.interrupt_queues.append(queue)
+
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self.interrupt_queues.remove(queue)
+
+    def poll_interrupts(self, reset=False):
+        """
+            Poll the received interrupts. Returns an array of the 4 interrupts.
+
+            Arguments:
+                reset (bool): Whether to reset the interrupts after reading.
+        """
+
+        ret = self.interrupts[:]
+        if reset:
+            self.reset_interrupts()
+
+        return ret
+
+    def reset_interrupts(self):
+        """
+            Reset interrupts regardless of whether they have been polled.
+        """
+        self.interrupts = [False, False, False, False]
+
+    def close(self):
+        if self.loop is not None:
+            self.loop.remove_reader(self.port.fileno())
+            self.loop = None
+
+        for t in list(self.send_queue) + list(self.recv_queue):
+            if not t.future.done():
+                t.future.set_exception(ConnectionError("Bus was closed"))
+        self.send_queue.clear()
+        self.recv_queue.clear()
+
+        self.port.close()
+
+    # Async context manager compliance
+    async def __aenter__(self):
+        self._attach()
+        return self
+
+    async def __aexit__(self, exception_type, exception_value, traceback):
+        self.close()
@@ -0,0 +1,132 @@
+from collections import OrderedDict
+
+# Cacheability policies for address regions
+VOLATILE = "volatile"           # Never cached (default for undeclared addresses)
+WRITE_THROUGH = "write-through" # Cached; writes go to the bus and update the shadow
+CONSTANT = "constant"           # Cached; read-only, e.g. ROM or ID registers
+
+"""
+    Host-side shadow of bus registers. Addresses are cached according to the
+    policy of the region they fall in, and the shadow holds at most `max_size`
+    words, evicting the least recently used first.
+"""
+class RegisterCache:
+
+    def __init__(self, max_size=4096):
+        self.max_size = max_size
+        self.regions = []
+        self.entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def add_region(self, address, n, policy):
+        """
+            Declare the cacheability of the `n` words starting at `address`. Later declarations take precedence over earlier overlapping ones.
+
+            Arguments:
+                address (int): The base address of the region.
+                n (int): The number of words in the region.
+                policy (str): One of VOLATILE, WRITE_THROUGH or CONSTANT.
+        """
+        assert policy in (VOLATILE, WRITE_THROUGH, CONSTANT)
+        self.regions.insert(0, (address, address + n, policy))
+        self.invalidate(address, n)
+
+    def policy(self, address):
+        for start, end, policy in self.regions:
+            if start <= address < end:
+                return policy
+
+        return VOLATILE
+
+    def cacheable(self, address):
+        return self.policy(address) != VOLATILE
+
+    # Returns the policies of the `n` words starting at `address` as a list
+    # of (start, end, policy) runs, scanning the regions once per run rather
+    # than once per word
+    def _spans(self, address, n):
+        end = address + n
+        bounds = {address, end}
+        for start, stop, policy in self.regions:
+            bounds.update(b for b in (start, stop) if address < b < end)
+
+        bounds = sorted(bounds)
+        spans = []
+        for start, stop in zip(bounds, bounds[1:]):
+            policy = self.policy(start)
+            if spans and spans[-1][2] == policy:
+                spans[-1] = (spans[-1][0], stop, policy)
+            else:
+                spans.append((start, stop, policy))
+
+        return spans
+
+    def lookup(self, address, n=1):
+        """
+            Returns the cached values of the `n` words starting at `address`, or None unless all of them are cached.
+        """
+        values = []
+        for a in range(address, address + n):
+            if a not in self.entries:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(a)
+            values.append(self.entries[a])
+
+        self.hits += 1
+        return values
+
+    def fill(self, address, values):
+        """
+            Record `values` read from or written to the words starting at `address`. Non-cacheable addresses and `None` values are skipped.
+        """
+        for start, end, policy in self._spans(address, len(values)):
+            if policy == VOLATILE:
+                continue
+
+            for a in range(start, end):
+                value = values[a - address]
+                if value is None:
+                    continue
+
+                self.entries[a] = value
+                self.entries.move_to_end(a)
+
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    # Called after a write of `values` (any sequence, e.g. a list with None
+    # holes or a memoryview) starting at `address`
+    def written(self, address, values):
+        for start, end, policy in self._spans(address, len(values)):
+            # Writes to constant regions are not expected to stick
+            if policy == WRITE_THROUGH:
+                self.fill(start, values[start - address:end - address])
+            elif policy == CONSTANT:
+                for a in range(start, end):
+                    if values[a - address] is not None:
+                        self.entries.pop(a, None)
+
+    def invalidate(self, address=None, n=1):
+        """
+            Drop cached values for the `n` words starting at `address`, or for all addresses if `address` is None.
+        """
+        if address is None:
+            self.entries.clear()
+            return
+
+        if n > len(self.entries):
+            for a in [a for a in self.entries if address <= a < address + n]:
+                del self.entries[a]
+        else:
+            for a in range(address, address + n):
+                self.entries.pop(a, None)
+
+    def flush(self):
+        """
+            Drop every cached value. As the cache is write-through there is never any data to write back.
+        """
+        self.invalidate()
@@ -1,81 +1,799 @@
+import os
+import sys
 import time
-from serial import Serial
+import mmap
+import select
+import threading
+from array import array
+from collections import deque
 from .utils import *
+from .ring_buffer import RingBuffer, ResponseQueue
+from .transaction import Transaction
+from .sampler import Sampler
+from .planner import CostModel, plan_write
+from .metrics import Metrics
+from .tuning import Tuner
+from .trace import TraceRecorder, TRACE_TX, TRACE_RX
+from .transport import open_transport
 
 """
     Wrapper for UART debug bus. Handles flow-control and buffering internally.
 """
 class DebugBus:
 
-    def __init__(self, serial_port, baud, fifo_size, timeout=0):
+    def __init__(self, serial_port, baud, fifo_size, timeout=0, prerender=False, background_reader=False, adaptive=False):
         # Maximum number of ops that can be in-pipeline at once
+        self.fifo_size = fifo_size
         self.max_buf = (fifo_size - 2) if fifo_size > 2 else fifo_size
         assert self.max_buf > 0
 
-        # No timeout for serial port 
-        # Instead, use unblocking serial port and block internally
-        self.port = Serial(serial_port, baud, timeout=0)
+        self.port = self._open_port(serial_port, baud)
+        self.baud = baud
         self.timeout = timeout
 
+        # Optional RegisterCache serving reads of cacheable registers
+        self.cache = None
+
+        # Used to plan sparse writes, see plan_write()
+        self.cost_model = CostModel(baud)
+        self.last_write_plan = None
+
+        # Transport statistics, see Metrics
+        self.metrics = Metrics(baud, self.max_buf, self.cost_model.bits_per_byte)
+
+        # In-flight window and write granularity, tuned from the measured
+        # round-trip time and response rate in adaptive mode, see Tuner
+        self.tuner = Tuner(self.max_buf, adaptive)
+
+        # Optional TraceRecorder capturing all bytes sent and received
+        self.trace = None
+
+        # Pollable handle for the port, if the platform provides one
+        try:
+            self.port_fd = self.port.fileno()
+        except (AttributeError, OSError):
+            self.port_fd = None
+
+        # Render the full command stream of a transfer before sending any
+        # of it, so an encoding error can never leave a transfer half-sent
+        self.prerender = prerender
+
         self.interrupts = [False, False, False, False]
 
-        self.recv_buffer = []
-        self.recv_responses = []
+        # Interrupt history: per-interrupt counts and last arrival times
+        # (time.monotonic()), plus a log of recent (timestamp, number) events
+        self.interrupt_counts = [0, 0, 0, 0]
+        self.interrupt_times = [None, None, None, None]
+        self.interrupt_events = deque(maxlen=4096)
+        self.interrupt_callbacks = [[], [], [], []]
+
+        self.recv_buffer = RingBuffer()
+        self.recv_responses = ResponseQueue()
+
+        # Guards the receive state when the background reader is running, and
+        # is notified whenever frames arrive
+        self.rx_lock = threading.Condition()
+        self.rx_count = 0
+        self.rx_seen = 0
+        self.rx_error = None
+
+        # Time (time.monotonic()) bytes last arrived, and whether the
+        # receive path is only collecting bytes to realign on the response to
+        # a bus reset after a framing error
+        self.rx_time = 0.0
+        self.rx_resync = False
+
+        # Responses the running transfer still expects (including those
+        # queued), see _receive(), and whether it takes bus errors as
+        # responses (in place of the failed command's) instead of raising
+        self.rx_expected = 0
+        self.rx_keep_errors = False
+
+        # Seconds of idle line after which the device drops a partial command
+        # frame (DROP_CLKS / CLK_FREQ), how often a transfer may be
+        # resynchronized after framing errors, how long to wait for the
+        # device to answer each resynchronization, see _resync(), whether
+        # timeouts are recovered from like framing errors instead of raised,
+        # and whether read-only transfers also repeat the last window of
+        # answered commands when resuming, see _pipeline()
+        self.drop_time = 0.1
+        self.resync_attempts = 3
+        self.resync_timeout = 0.5
+        self.resync_on_timeout = False
+        self.resync_repeat_window = False
+
+        self.reader = None
+        self.reader_stop = False
+        if background_reader:
+            self.start_reader()
+
+    def _open_port(self, serial_port, baud):
+        # Already-open port-like object (e.g. a transport or a ReplayPort)
+        if not isinstance(serial_port, str):
+            serial_port.timeout = 0
+            return serial_port
+
+        return open_transport(serial_port, baud)
+
+    # Write encoded frames to the port
+    def _write_port(self, data):
+        self.port.write(data)
+        self.metrics.sent(data)
+
+        if self.trace is not None:
+            self.trace.record(TRACE_TX, data)
 
     # Read as much data from the port as is available and store it
     def _read_port(self):
+        if self.reader is not None:
+            # Background reader owns the port, just pick up its state
+            with self.rx_lock:
+                self.rx_seen = self.rx_count
+                error, self.rx_error = self.rx_error, None
+
+            if error is not None:
+                raise error
+            return
+
         data = self.port.read(10000) # Read as much data is available
-        self.recv_buffer.extend(list(data))
-
-        while len(self.recv_buffer) >= 5:
-            instr = parse_instruction(self.recv_buffer[0:5])
-            self.recv_buffer = self.recv_buffer[5:]
-
-            # Parse interrupts
-            if instr[0] in RESP_INTERRUPT_ALL:
-                if instr[0] == RESP_INTERRUPT_1:
-                    self.interrupts[0] = True
-                if instr[0] == RESP_INTERRUPT_2:
-                    self.interrupts[1] = True
-                if instr[0] == RESP_INTERRUPT_3:
-                    self.interrupts[2] = True
-                if instr[0] == RESP_INTERRUPT_4:
-                    self.interrupts[3] = True
-
-            elif instr[0] == RESP_BUS_ERROR:
-                raise RuntimeError("Bus error received")
+        error = self._receive(data)
+        if error is not None:
+            raise error
+
+    # Record interrupt `index` (0-3) arriving at `now`, with rx_lock held
+    def _record_interrupt(self, index, now):
+        self.interrupts[index] = True
+        self.interrupt_counts[index] += 1
+        self.interrupt_times[index] = now
+        self.interrupt_events.append((now, index + 1))
+
+    # Run the callbacks of the interrupts (0-3) in `fired`
+    def _run_callbacks(self, fired):
+        for index in fired:
+            for callback in self.interrupt_callbacks[index]:
+                callback(index + 1, self.interrupt_times[index])
+
+    # Discard received bytes up to and including the last response to a bus
+    # reset, with rx_lock held. Interrupts among the discarded bytes are
+    # still recorded if they are aligned frames
+    # Returns the indices of those interrupts, or None if no response to a
+    # reset has arrived
+    def _skip_to_reset(self):
+        buf = bytes(self.recv_buffer.peek(len(self.recv_buffer)))
+        pos = buf.rfind(RESET_FRAME)
+        if pos < 0:
+            return None
+
+        fired = []
+        if (pos % FRAME_SIZE == 0) and (find_invalid_frame(buf[0:pos]) < 0):
+            now = time.monotonic()
+            for inst in decode_frames(buf[0:pos])[0]:
+                if inst in RESP_INTERRUPT_ALL:
+                    index = RESP_INTERRUPT_ALL.index(inst)
+                    self._record_interrupt(index, now)
+                    fired.append(index)
+
+        self.recv_buffer.consume(pos + FRAME_SIZE)
+        self.rx_resync = False
+        self.rx_count += 1
+        return fired
+
+    # Decode received bytes, queue responses and handle interrupts
+    # Decoding stops before the first frame the device cannot have sent, and
+    # the frame preceding it is discarded too: a lost data byte only shows in
+    # the frame after the one it was lost from, which has taken the next
+    # frame's first byte in its place. For the same reason, while more frames
+    # are expected, the last frame is only decoded once the first byte of the
+    # next one has confirmed it
+    # Returns the exception to raise on a bus error or framing error, if any
+    def _receive(self, data):
+        fired = []
+        bus_error = False
+        nbytes = len(data)
+
+        if (self.trace is not None) and nbytes:
+            self.trace.record(TRACE_RX, data)
+
+        with self.rx_lock:
+            start = time.perf_counter()
+            self.recv_buffer.write(data)
+            if nbytes:
+                self.rx_time = time.monotonic()
+
+            # Realigning, see _resync(); wake up any waiter to check
+            if self.rx_resync:
+                self.metrics.received(b"", nbytes)
+                self.rx_count += 1
+                self.rx_lock.notify_all()
+                return None
+
+            if len(self.recv_buffer) < FRAME_SIZE:
+                self.metrics.received(b"", nbytes)
+                return None
+
+            n = len(self.recv_buffer) // FRAME_SIZE
+            raw = self.recv_buffer.peek(min(len(self.recv_buffer), n * FRAME_SIZE + 1))
+            invalid = find_invalid_frame(raw)
+            if (invalid < 0) and (len(raw) > n * FRAME_SIZE) and (raw[-1] not in VALID_RESPONSE_BYTES):
+                invalid = n
+
+            if invalid >= 0:
+                count = max(0, invalid - 1)
+            elif (len(raw) == n * FRAME_SIZE) and (self.rx_expected > len(self.recv_responses) + n):
+                count = max(0, n - 1)
+            else:
+                count = n
+
+            opcodes, data = self.recv_buffer.pop_frames(count)
+            self.rx_count += len(opcodes)
+
+            # Fast path: nothing but ordinary responses
+            if not any((x in opcodes) for x in RESP_SPECIAL):
+                self.recv_responses.extend(opcodes, data)
 
             else:
-                self.recv_responses.append(instr)
-    
+                now = time.monotonic()
+                for inst, word in zip(opcodes, data):
+                    # Parse interrupts
+                    if inst in RESP_INTERRUPT_ALL:
+                        index = RESP_INTERRUPT_ALL.index(inst)
+                        self._record_interrupt(index, now)
+                        fired.append(index)
+
+                    elif (inst == RESP_BUS_ERROR) and not self.rx_keep_errors:
+                        bus_error = True
+
+                    else:
+                        self.recv_responses.append(inst, word)
+
+            self.metrics.received(opcodes, nbytes)
+            self.metrics.decode_time += time.perf_counter() - start
+            self.rx_lock.notify_all()
+
+        self._run_callbacks(fired)
+
+        if bus_error:
+            return RuntimeError("Bus error received")
+
+        if invalid >= 0:
+            return FramingError("Invalid response frame received")
+
+        return None
+
+    # Body of the background reader thread
+    def _reader_loop(self):
+        while not self.reader_stop:
+            try:
+                if self.port_fd is not None:
+                    readable = select.select([self.port_fd], [], [], 0.1)[0]
+                    data = self.port.read(10000) if readable else b""
+                else:
+                    data = self.port.read(max(1, self.port.in_waiting))
+
+                error = self._receive(data)
+
+            except Exception as e:
+                if self.reader_stop:
+                    return
+                error = e
+
+            if error is not None:
+                with self.rx_lock:
+                    self.rx_error = error
+                    self.rx_lock.notify_all()
+
+    def start_reader(self):
+        """
+            Start a background thread which reads and decodes frames from the port continuously, so that interrupts are recorded (and their callbacks run) as soon as they arrive rather than only when the bus is next accessed.
+        """
+        if self.reader is not None:
+            return
+
+        # Blocking reads with a short timeout if the port cannot be polled
+        if self.port_fd is None:
+            self.port.timeout = 0.1
+
+        self.reader_stop = False
+        self.reader = threading.Thread(target=self._reader_loop, daemon=True)
+        self.reader.start()
+
+    def stop_reader(self):
+        """
+            Stop the background reader thread, if it is running.
+        """
+        if self.reader is None:
+            return
+
+        self.reader_stop = True
+        self.reader.join()
+        self.reader = None
+        self.port.timeout = 0
+
+    # Block until the port has data available or `deadline` (in terms of
+    # time.monotonic(), None = no deadline) has passed
+    # `nbytes` is the number of bytes the caller is waiting for
+    def _wait_port(self, deadline, nbytes=FRAME_SIZE):
+        start = time.perf_counter()
+        timeout = None
+        if deadline is not None:
+            timeout = max(0, deadline - time.monotonic())
+
+        if self.reader is not None:
+            # Wait for the reader to deliver anything new since _read_port()
+            with self.rx_lock:
+                self.rx_lock.wait_for(
+                    lambda: (self.rx_count != self.rx_seen) or (self.rx_error is not None),
+                    timeout
+                )
+
+        elif self.port_fd is not None:
+            select.select([self.port_fd], [], [], timeout)
+
+        else:
+            # No pollable handle (e.g. on Windows), so block in the port's
+            # own read until the expected bytes arrive or time runs out
+            self.port.timeout = timeout
+            try:
+                data = self.port.read(max(1, nbytes))
+                self.recv_buffer.write(data)
+                if data:
+                    self.rx_time = time.monotonic()
+                self.metrics.received(b"", len(data))
+
+                if self.trace is not None:
+                    self.trace.record(TRACE_RX, data)
+            finally:
+                self.port.timeout = 0
+
+        self.metrics.wait_time += time.perf_counter() - start
+
+    # Deadline for a wait starting now, based on the configured timeout
+    def _deadline(self):
+        if self.timeout == 0:
+            return None
+
+        return time.monotonic() + self.timeout
+
     # Blocking-read `n` instructions from serial port
     # If n = 0, will read 1 instruction in a non-blocking manner
+    # Returns (opcode_array, data_array)
     def _read_data(self, n=0):
-        first = True
-
-        start_time = time.time()
+        deadline = self._deadline()
         while True:
             self._read_port()
 
-            if n == 0:
-                if len(self.recv_responses) >= 1:
-                    resp = self.recv_responses[0:1]
-                    self.recv_responses = self.recv_responses[1:]
-                    return resp
+            with self.rx_lock:
+                if n == 0:
+                    if len(self.recv_responses) >= 1:
+                        return self.recv_responses.pop(1)
+                    else:
+                        return None
+
                 else:
-                    return None
+                    if len(self.recv_responses) >= n:
+                        return self.recv_responses.pop(n)
 
+            if (deadline is not None) and (time.monotonic() > deadline):
+                raise TimeoutError("Remote device not responding")
+
+            needed = FRAME_SIZE * (n - len(self.recv_responses))
+            self._wait_port(deadline, needed - len(self.recv_buffer))
+
+    # Throw away everything received until the port has been quiet for
+    # `quiet` seconds, e.g. the remaining responses of a failed transfer
+    def _discard_input(self, quiet=0.05):
+        while True:
+            try:
+                self._read_port()
+            except RuntimeError:
+                pass
+
+            with self.rx_lock:
+                before = self.rx_count
+                self.rx_error = None
+
+            self._wait_port(time.monotonic() + quiet)
+
+            try:
+                self._read_port()
+            except RuntimeError:
+                pass
+
+            with self.rx_lock:
+                if self.rx_count == before:
+                    self.recv_buffer.clear()
+                    self.recv_responses.clear()
+                    self.rx_error = None
+                    return
+
+    # Recover from a framing error (a lost or corrupted byte in either
+    # direction): stay idle until the device has dropped any partial command
+    # frame (DROP_CLKS), then reset the bus. Once the line has been quiet for
+    # `drop_time` again, the received bytes are discarded up to the last
+    # response to a reset (misaligned commands may have caused others), which
+    # realigns the receive path. Commands in flight are aborted and their
+    # responses discarded
+    def _resync(self):
+        self.metrics.resyncs += 1
+
+        # Commands still queued for transmission delay the idle time
+        bits = self.max_buf * FRAME_SIZE * self.cost_model.bits_per_byte
+        time.sleep(self.drop_time * 1.25 + bits / self.baud)
+
+        with self.rx_lock:
+            self.recv_buffer.clear()
+            self.recv_responses.clear()
+            self.rx_error = None
+            self.rx_expected = 0
+            self.rx_resync = True
+
+        self._write_port(encode_frames(CMD_BUS_RESET, [0]))
+        sent_time = time.monotonic()
+
+        deadline = sent_time + self.resync_timeout
+        try:
+            while True:
+                self._read_port()
+
+                fired = None
+                wait_deadline = deadline
+                with self.rx_lock:
+                    if self.rx_time > sent_time:
+                        if time.monotonic() - self.rx_time > self.drop_time:
+                            fired = self._skip_to_reset()
+                        else:
+                            wait_deadline = self.rx_time + self.drop_time
+
+                if fired is not None:
+                    self._run_callbacks(fired)
+                    return
+
+                if time.monotonic() > deadline:
+                    raise TimeoutError("Remote device not responding to bus reset")
+
+                self._wait_port(min(deadline, wait_deadline))
+
+        finally:
+            with self.rx_lock:
+                self.rx_resync = False
+
+    # Note the expected responses of a chunk of encoded commands starting at
+    # command `index`, and the (index, opcode, address) of its address sets
+    # Returns whether the chunk holds a non-incrementing address set
+    def _track_commands(self, chunk, index, expected, addr_sets):
+        opcodes = bytes(memoryview(chunk)[0::FRAME_SIZE]).translate(OPCODE_MASK)
+        expected.extend(opcodes.translate(EXPECTED_RESPONSE))
+
+        peripheral = False
+        for m in ADDR_SET_RE.finditer(opcodes):
+            i = m.start()
+            addr_sets.append((index + i, opcodes[i], FRAME_STRUCT.unpack_from(chunk, i * FRAME_SIZE)[1]))
+            peripheral = peripheral or (opcodes[i] == CMD_SET_ADDR)
+
+        return peripheral
+
+    # Returns the encoded address set which restores the device's address
+    # register for resuming a command stream at command `index` (b"" if that
+    # command is an address set itself), given the stream's address sets
+    def _restore_address(self, addr_sets, index):
+        last = None
+        for entry in addr_sets:
+            if entry[0] == index:
+                return b""
+            if entry[0] < index:
+                last = entry
+
+        if last is None:
+            raise FramingError("Cannot resume transfer after framing error")
+
+        position, opcode, address = last
+        if opcode == CMD_SET_ADDR_INC:
+            address = (address + index - position - 1) & 0xffffffff
+
+        return encode_frames(opcode, [address])
+
+    # Pipeline `n` commands through the device and yield their responses
+    # (opcode_array, data_array) in order as they arrive
+    # `render(start, end)` returns the encoded frames for commands [start, end)
+    # Up to `tuner.window` commands (at most `max_buf`) are kept in flight:
+    # once at least `tuner.min_write` responses have come back, the window is
+    # topped up again in a single port write
+    # On a framing error (an invalid frame, a response of the wrong type, a
+    # partial frame left incomplete for longer than `drop_time`), or on a
+    # timeout if `resync_on_timeout` is set, the bus is resynchronized and the
+    # unanswered commands are sent again, after an address set restoring the
+    # address they continue from
+    # After a byte lost on the way to the device, misaligned commands can
+    # produce responses of the expected type before the error shows, so with
+    # `resync_repeat_window` set, transfers which have not written anything
+    # send the last window of answered commands again as well, with their
+    # responses discarded
+    # Commands to peripherals are not safe to repeat, so once any have been
+    # sent, the bus is only resynchronized and the error raised
+    # If the generator is closed early, responses to commands already sent
+    # are drained (and discarded) so they cannot leak into the next transfer
+    # If `interval` is nonzero, commands are paced: the first two (e.g. an
+    # address set and the first read) are sent at once, and each following
+    # one `interval` seconds after the previous
+    # If `end_time` (in terms of time.monotonic()) is given, the transfer
+    # raises TimeoutError once it passes, whether or not the device answers
+    # If `bus_errors` is set, bus errors are yielded in place of the responses
+    # of the failed commands instead of raised
+    # `op` names the operation type in the bus's metrics
+    def _pipeline(self, n, render, op="transfer", interval=0, end_time=None, bus_errors=False):
+        sent = 0
+        received = 0
+
+        # Responses still to come which are not yielded: those of a restoring
+        # address set and of answered commands sent again after a resync
+        restoring = 0
+        resyncs = 0
+
+        # Whether the commands sent so far are safe to send again, i.e. none
+        # of them went to a peripheral (a register used as a pipe, through a
+        # non-incrementing address set)
+        resumable = True
+
+        # Whether no write requests have been sent, so answered commands may
+        # be repeated too
+        read_only = True
+
+        # Expected response opcodes of the commands in flight, and the
+        # address sets sent from the last one a window before `received` on
+        expected = bytearray()
+        addr_sets = deque()
+
+        metrics = self.metrics
+        state = metrics.begin_transfer()
+
+        tuner = self.tuner
+        window = tuner.window
+        min_write = tuner.min_write
+
+        # (index of first command, send time, sent into an idle pipeline) of
+        # each window not yet answered
+        windows = deque()
+
+        # Arrival of the first responses and of the latest ones, to measure
+        # the response rate
+        first_time = None
+        first_count = 0
+        last_time = None
+
+        with self.rx_lock:
+            self.rx_keep_errors = bus_errors
+
+        start_time = time.monotonic()
+        deadline = self._deadline()
+        try:
+            while received < n:
+                # Commands which may be sent by now
+                released = n
+                if interval:
+                    released = min(n, 2 + int((time.monotonic() - start_time) / interval))
+
+                in_flight = sent - received + restoring
+                credits = min(window - in_flight, released - sent)
+                if (credits > 0) and (credits >= min(min_write, released - sent)):
+                    start = time.perf_counter()
+                    chunk = render(sent, sent + credits)
+                    if self._track_commands(chunk, sent, expected, addr_sets):
+                        resumable = False
+                    if read_only and (expected.find(RESP_WRITE_ACK, len(expected) - credits) >= 0):
+                        read_only = False
+                    now = time.perf_counter()
+                    metrics.encode_time += now - start
+
+                    self._write_port(chunk)
+                    if sent >= received:
+                        windows.append((sent, now, in_flight == 0))
+                    sent += credits
+                    metrics.window(in_flight + credits)
+
+                    with self.rx_lock:
+                        self.rx_expected = in_flight + credits
+
+                    # Time out only while responses are owed
+                    if in_flight == 0:
+                        deadline = self._deadline()
+
+                error = None
+                num_words = 0
+                try:
+                    self._read_port()
+
+                    with self.rx_lock:
+                        num_words = min(len(self.recv_responses), sent - received + restoring)
+                        if num_words > 0:
+                            resp = self.recv_responses.pop(num_words)
+                            self.rx_expected = sent - received + restoring - num_words
+
+                    if (num_words > 0) and (resp[0].tobytes() != expected[0:num_words]):
+                        if not (bus_errors and self._match_errors(resp[0], expected[0:num_words])):
+                            raise FramingError("Unexpected response received")
+
+                    if num_words == 0:
+                        # A partial frame is never left incomplete for long
+                        with self.rx_lock:
+                            stuck = (len(self.recv_buffer) % FRAME_SIZE != 0) and \
+                                    (time.monotonic() - self.rx_time > self.drop_time)
+                        if stuck:
+                            raise FramingError("Incomplete response frame received")
+
+                        owed = sent - received + restoring > 0
+                        if owed and (deadline is not None) and (time.monotonic() > deadline):
+                            tuner.timeout()
+                            raise TimeoutError("Remote device not responding")
+
+                except FramingError as e:
+                    error = e
+
+                except TimeoutError as e:
+                    if not self.resync_on_timeout:
+                        raise
+                    error = e
+
+                if (error is not None) and not resumable:
+                    # Realign for the next transfer, but never repeat
+                    # commands to peripherals
+                    self._resync()
+                    raise error
+
+                if (error is not None) and (resyncs == self.resync_attempts):
+                    raise error
+
+                if error is not None:
+                    # Resume at the first unanswered command (or a window
+                    # before it, see above)
+                    resyncs += 1
+                    self._resync()
+
+                    resume = received
+                    if self.resync_repeat_window and read_only:
+                        resume = max(0, received - window)
+                    prefix = self._restore_address(addr_sets, resume)
+                    expected.clear()
+                    windows.clear()
+                    sent = resume
+                    restoring = received - resume
+
+                    if prefix:
+                        self._track_commands(prefix, resume, expected, deque())
+                        self._write_port(prefix)
+                        restoring += 1
+
+                        with self.rx_lock:
+                            self.rx_expected = sent - received + restoring
+
+                    deadline = self._deadline()
+                    continue
+
+                if num_words > 0:
+                    del expected[0:num_words]
+                    deadline = self._deadline()
+
+                    if restoring:
+                        skip = min(restoring, num_words)
+                        restoring -= skip
+                        num_words -= skip
+                        resp = (resp[0][skip:], resp[1][skip:])
+                        if num_words == 0:
+                            continue
+
+                    received += num_words
+                    while (len(addr_sets) > 1) and (addr_sets[1][0] < received - window):
+                        addr_sets.popleft()
+
+                    now = time.perf_counter()
+                    while windows and (windows[0][0] < received):
+                        first, sent_time, idle = windows.popleft()
+                        metrics.rtt.record(now - sent_time)
+
+                        # Windows queued behind others include their
+                        # transmission time, so only idle ones measure the
+                        # link's own round-trip time
+                        if idle:
+                            tuner.sample_rtt(now - sent_time)
+
+                    if first_time is None:
+                        first_time = now
+                        first_count = received
+                    last_time = now
+
+                    yield resp
+                    continue
+
+                # Give up once the transfer's time limit has passed
+                if (end_time is not None) and (time.monotonic() > end_time):
+                    if sent - received + restoring > 0:
+                        self._discard_input()
+                    raise TimeoutError("Transfer not finished in time")
+
+                # Wait for the responses which allow the next write, or for
+                # all of them once everything has been sent (but for the
+                # first response of an idle window, to measure the
+                # round-trip time)
+                in_flight = sent - received + restoring
+                needed = in_flight
+                if windows and windows[0][2]:
+                    needed = 1
+                elif sent < n:
+                    needed = min(needed, min(min_write, n - sent) - (window - in_flight))
+
+                # Wake up in time to notice a partial frame left incomplete,
+                # and to send the next paced command
+                wait_deadline = deadline
+                if interval and (sent < n):
+                    release_time = start_time + (sent - 1) * interval
+                    wait_deadline = release_time if deadline is None else min(deadline, release_time)
+                if end_time is not None:
+                    wait_deadline = end_time if wait_deadline is None else min(wait_deadline, end_time)
+
+                with self.rx_lock:
+                    if len(self.recv_buffer) % FRAME_SIZE != 0:
+                        stuck_time = self.rx_time + self.drop_time
+                        wait_deadline = stuck_time if wait_deadline is None else min(wait_deadline, stuck_time)
+
+                needed = FRAME_SIZE * (needed - len(self.recv_responses))
+                self._wait_port(wait_deadline, needed - len(self.recv_buffer))
+
+            # Only transfers spanning more than a window keep the link busy
+            # long enough to measure its rate
+            if n > window:
+                tuner.end_transfer(received - first_count, last_time - first_time)
             else:
-                if len(self.recv_responses) >= n:
-                    resp = self.recv_responses[0:n]
-                    self.recv_responses = self.recv_responses[n:]
-                    return resp
+                tuner.end_transfer(0, 0)
+
+        except GeneratorExit:
+            if sent - received + restoring > 0:
+                self._read_data(sent - received + restoring)
+            raise
+
+        finally:
+            with self.rx_lock:
+                self.rx_expected = 0
+                self.rx_keep_errors = False
+
+            metrics.end_transfer(op, received, state)
+
+    # Whether response `opcodes` match the `expected` ones, except for bus
+    # errors standing in for the responses of failed commands
+    def _match_errors(self, opcodes, expected):
+        return all((x == y) or (x == RESP_BUS_ERROR) for x, y in zip(opcodes, expected))
+
+    # Returns a render function for _pipeline() over the given commands
+    def _render(self, cmds, words):
+        if self.prerender:
+            stream = memoryview(encode_frames(cmds, words))
+            return lambda start, end: stream[start * FRAME_SIZE:end * FRAME_SIZE]
+        else:
+            return lambda start, end: encode_frames(cmds[start:end], words[start:end])
 
-            first = False
-            if (self.timeout != 0) and (time.time() - start_time > self.timeout):
-                raise TimeoutError("Remote device not responding")
+    # Send a stream of commands and collect the one response each produces
+    # (a bus error, with `bus_errors` set, see _pipeline())
+    # Returns (opcode_array, data_array)
+    def _transfer(self, cmds, words, op="transfer", bus_errors=False):
+        opcodes = array("B")
+        data = array("I")
+
+        pipeline = self._pipeline(len(cmds), self._render(cmds, words), op, bus_errors=bus_errors)
+        for resp_opcodes, resp_data in pipeline:
+            opcodes.extend(resp_opcodes)
+            data.extend(resp_data)
+
+        return opcodes, data
+
+    # Read from the bus, bypassing the cache
+    # Returns an array('I')
+    def _read_bus(self, address, n, increment):
+        cmds, words = read_commands(address, n, increment)
+        opcodes, data = self._transfer(cmds, words, "read" if increment else "read_peripheral")
+
+        # Remove address-acknowledge
+        assert opcodes[0] == RESP_ADDR_ACK
+        assert opcodes.count(RESP_READ_RESP) == n
 
-            time.sleep(0.01)
+        return data[1:]
 
     def read(self, address, n=1, _increment=True):
         """
@@ -85,45 +803,103 @@ class DebugBus:
                 address (int): The base address to read from. 
                 n (int): The number of values to read starting at the given address.
         """
-        
-        ret = []
 
-        # Set address
-        self.port.write(bytearray(create_instruction(
-            CMD_SET_ADDR_INC if _increment else CMD_SET_ADDR, address
-        )))
+        if (self.cache is not None) and _increment:
+            values = self.cache.lookup(address, n)
+            if values is not None:
+                return values
 
-        # Include address-set in first-round buffer-count 
-        first_round = 1
+        values = self._read_bus(address, n, _increment).tolist()
+        if self.cache is not None:
+            if _increment:
+                self.cache.fill(address, values)
+            else:
+                self.cache.invalidate(address)
 
-        # One extra readback (for address)
-        n = n + 1
+        return values
 
-        # Send only enough ops at once to avoid overflowing buffer
-        while n > 0:
-            num_words = min(self.max_buf, n)
+    def read_into(self, address, out, _increment=True):
+        """
+            Read contiguous 32-bit words starting at `address` directly into `out`, filling it completely. `out` may be any writable buffer of native-endian 32-bit words (e.g. an `array('I')`, a NumPy `uint32` array or a `memoryview`) or of raw bytes (e.g. a `bytearray` whose length is a multiple of 4). Always reads from the bus, bypassing the cache. Blocks execution until finished or timed out. Returns the number of words read.
 
-            for i in range(num_words - first_round):
-                self.port.write(bytearray(create_instruction(
-                    CMD_READ_REQ, 0
-                )))
+            Arguments:
+                address (int): The base address to read from.
+                out (buffer): The buffer to fill.
+        """
 
-            first_round = 0
+        view = word_view(out)
+        n = len(view)
+        cmds, words = read_commands(address, n, _increment)
 
-            ret.extend(self._read_data(num_words))
-            n = n - num_words
+        # First response is the address-acknowledge
+        pos = -1
+        for opcodes, data in self._pipeline(len(cmds), self._render(cmds, words), "read"):
+            if pos < 0:
+                assert opcodes[0] == RESP_ADDR_ACK
+                opcodes = opcodes[1:]
+                data = data[1:]
+                pos = 0
 
-        # Remove address-acknowledge
-        assert ret[0][0] == RESP_ADDR_ACK
-        ret = ret[1:]
-        for inst, data in ret:
-            assert inst == RESP_READ_RESP
-        ret = [int(x[1]) for x in ret]
-
-        if n == 1:
-            return ret[0]
-        else:
-            return ret
+            assert opcodes.count(RESP_READ_RESP) == len(opcodes)
+            view[pos:pos + len(data)] = data
+            pos += len(data)
+
+        return n
+
+    def read_stream(self, address, n, chunk_words=1024, _increment=True):
+        """
+            Read `n` contiguous 32-bit words starting at `address`, yielding them in chunks as they arrive instead of returning them all at once. Memory use is bounded by the chunk size regardless of `n`. Each chunk is an `array('I')` of `chunk_words` values (the last chunk may be shorter). Always reads from the bus, bypassing the cache. If the generator is closed early, the remaining in-flight responses are discarded.
+
+            Arguments:
+                address (int): The base address to read from.
+                n (int): The number of values to read starting at the given address.
+                chunk_words (int): The number of values in each yielded chunk.
+        """
+
+        set_frame = encode_frames(CMD_SET_ADDR_INC if _increment else CMD_SET_ADDR, [address])
+        read_frame = encode_frames(CMD_READ_REQ, [0])
+
+        # Commands are rendered on demand, so nothing scales with `n`
+        def render(start, end):
+            if start == 0:
+                return set_frame + read_frame * (end - 1)
+            return read_frame * (end - start)
+
+        chunk = array("I")
+        first = True
+        pipeline = self._pipeline(n + 1, render, "read_stream" if _increment else "read_peripheral_stream")
+        try:
+            for opcodes, data in pipeline:
+                # Remove address-acknowledge
+                if first:
+                    assert opcodes[0] == RESP_ADDR_ACK
+                    opcodes = opcodes[1:]
+                    data = data[1:]
+                    first = False
+
+                assert opcodes.count(RESP_READ_RESP) == len(opcodes)
+                chunk.extend(data)
+
+                while len(chunk) >= chunk_words:
+                    yield chunk[0:chunk_words]
+                    del chunk[0:chunk_words]
+        finally:
+            pipeline.close()
+
+        if len(chunk) > 0:
+            yield chunk
+
+    def read_peripheral_stream(self, address, n, chunk_words=1024):
+        """
+            Read `n` 32-bit words, all from `address`, yielding them in chunks as they arrive. This should be used for peripherals which use a single register as a pipe. See read_stream().
+
+            Arguments:
+                address (int): The singular address to read from.
+                n (int): The number of values to read from the given address.
+                chunk_words (int): The number of values in each yielded chunk.
+        """
+
+        return self.read_stream(address, n, chunk_words=chunk_words, _increment=False)
 
     def read_peripheral(self, address, n=1):
         """
@@ -136,6 +912,63 @@ class DebugBus:
 
         return self.read(address, n=n, _increment=False)
 
+    def wait_until(self, address, mask, value, timeout=None, interval=0):
+        """
+            Poll the 32-bit word at `address` until `(word & mask) == value`. A window of repeated reads of `address` is kept in flight, so the word is sampled as fast as the link allows (or every `interval` seconds), instead of once per round trip. Always reads from the bus, bypassing the cache. Returns a tuple (sample, count, elapsed) of the first matching word, the number of words sampled (including it) and the seconds from the call until it arrived. Raises TimeoutError if no sample matches within `timeout` seconds.
+
+            Arguments:
+                address (int): The address to poll.
+                mask (int): The bits of the word to compare.
+                value (int): The value the masked bits should have.
+                timeout (float): The maximum time to wait in seconds, or None to wait forever.
+                interval (float): The minimum time between samples in seconds (0 = back-to-back).
+        """
+
+        begin = time.monotonic()
+        deadline = None if timeout is None else begin + timeout
+
+        set_frame = encode_frames(CMD_SET_ADDR, [address])
+        read_frame = encode_frames(CMD_READ_REQ, [0])
+
+        def render(start, end):
+            if start == 0:
+                return set_frame + read_frame * (end - 1)
+            return read_frame * (end - start)
+
+        count = 0
+        first = True
+        pipeline = self._pipeline(1 << 48, render, "wait_until", interval, deadline)
+        try:
+            for opcodes, data in pipeline:
+                # Remove address-acknowledge
+                if first:
+                    assert opcodes[0] == RESP_ADDR_ACK
+                    opcodes = opcodes[1:]
+                    data = data[1:]
+                    first = False
+
+                assert opcodes.count(RESP_READ_RESP) == len(opcodes)
+                for i, sample in enumerate(data):
+                    if (sample & mask) == value:
+                        count += i + 1
+                        if self.cache is not None:
+                            self.cache.fill(address, [sample])
+                        return sample, count, time.monotonic() - begin
+
+                count += len(data)
+                if (deadline is not None) and (time.monotonic() > deadline):
+                    break
+
+        # The device may have stopped answering before the time limit
+        except TimeoutError:
+            if (deadline is None) or (time.monotonic() <= deadline):
+                raise
+
+        finally:
+            pipeline.close()
+
+        raise TimeoutError("Value not reached within {} seconds ({} samples)".format(timeout, count))
+
     def write(self, address, data, verify=False, _increment=True):
         """
             Write `data` into contiguous 32-bit words starting at `address`. Blocks execution until finished or timed out. `None` values in the data array will not be written. For writing multiple values to the same address (for peripherals which use a single register as a pipe), use write_peripheral().
@@ -146,69 +979,79 @@ class DebugBus:
                 verify (bool): Whether to read-back and verify the data after writing it.
         """
 
-        ret = []
-
-        # Set address
-        self.port.write(bytearray(create_instruction(
-            CMD_SET_ADDR_INC if _increment else CMD_SET_ADDR, address
-        )))
-
-        # Include address-set in first-round buffer-count 
-        first_round = 1
-
         # Check data format
         if isinstance(data, int):
             data = [data]
-        data_buf = data[:]
 
-        n = len(data)
+        if None in data:
+            # Sparse write: skip holes with reads or fresh address sets
+            assert _increment
+            t = self.batch()
+            for segment_address, segment in self.plan_write(address, data).segments:
+                t.write(segment_address, segment)
+            t.execute()
 
-        # One extra readback (for address)
-        n = n + 1
+        else:
+            cmds, words = write_commands(address, data, _increment)
+            opcodes = self._transfer(cmds, words, "write" if _increment else "write_peripheral")[0]
 
-        # Send only enough ops at once to avoid overflowing buffer
-        while n > 0:
-            num_words = min(self.max_buf, n)
+            # Remove address-acknowledge
+            assert opcodes[0] == RESP_ADDR_ACK
+            assert opcodes.count(RESP_WRITE_ACK) == len(data)
 
-            for i in range(num_words - first_round):
-                if data_buf[0] is None:
-                    assert _increment
-                    # Use read req to increment address w/o writing
-                    self.port.write(bytearray(create_instruction(
-                        CMD_READ_REQ, 0
-                    )))
+            if self.cache is not None:
+                if _increment:
+                    self.cache.written(address, data)
                 else:
-                    self.port.write(bytearray(create_instruction(
-                        CMD_WRITE_REQ, data_buf[0]
-                    )))
+                    self.cache.invalidate(address)
+
+        # Verify that correct data was written
+        if verify and _increment:
+            data_read = self._read_bus(address, len(data), True)
+
+            for i in range(len(data)):
+                assert (data_read[i] == data[i]) or (data[i] is None)
+
+    def write_from(self, address, buf, _increment=True):
+        """
+            Write the contents of `buf` into contiguous 32-bit words starting at `address`. `buf` may be any buffer of native-endian 32-bit words (e.g. an `array('I')`, a NumPy `uint32` array or a `memoryview`) or of raw bytes (e.g. a `bytearray` whose length is a multiple of 4), and is sent without being converted to a list. Blocks execution until finished or timed out.
 
-                data_buf = data_buf[1:]
+            Arguments:
+                address (int): The base address to write to.
+                buf (buffer): The data to write.
+        """
 
-            first_round = 0
+        view = word_view(buf)
+        n = len(view)
 
-            ret.extend(self._read_data(num_words))
-            n = n - num_words
+        cmds = bytes([CMD_SET_ADDR_INC if _increment else CMD_SET_ADDR])
+        cmds += bytes([CMD_WRITE_REQ]) * n
+        words = array("I", [address])
+        words.frombytes(view.cast("B"))
 
-        assert len(data_buf) == 0
+        opcodes = self._transfer(cmds, words, "write" if _increment else "write_peripheral")[0]
 
         # Remove address-acknowledge
-        assert ret[0][0] == RESP_ADDR_ACK
-        ret = ret[1:]
-        for i, resp in enumerate(ret):
-            if data[i] is None:
-                assert resp[0] == RESP_READ_RESP
+        assert opcodes[0] == RESP_ADDR_ACK
+        assert opcodes.count(RESP_WRITE_ACK) == n
+
+        if self.cache is not None:
+            if _increment:
+                self.cache.written(address, view)
             else:
-                assert resp[0] == RESP_WRITE_ACK
+                self.cache.invalidate(address)
 
-        # Verify that correct data was written
-        if verify and _increment:
-            data_read = self.read(address, n=len(data), _increment=True)
+    def plan_write(self, address, data):
+        """
+            Plan how a write of `data` (which may contain `None` holes) starting at `address` will be sent, using the bus's cost model (`cost_model`). Each hole is either stepped over with read requests or skipped by starting a new address set, whichever the model estimates to be cheaper. Returns a WritePlan, which is also kept as `last_write_plan`.
 
-            if len(data) == 1:
-                assert (data_read == data[0]) or (data[0] is None)
-            else:
-                for i in range(len(data)):
-                    assert (data_read[i] == data[i]) or (data[i] is None)
+            Arguments:
+                address (int): The base address to write to.
+                data (list[int]): The data to write.
+        """
+
+        self.last_write_plan = plan_write(address, data, self.cost_model)
+        return self.last_write_plan
 
     def write_peripheral(self, address, data):
         """
@@ -221,18 +1064,246 @@ class DebugBus:
 
         self.write(address, data, verify=False, _increment=False)
 
+    def read_many(self, addresses):
+        """
+            Read the 32-bit words at each of `addresses`, which may be in any order. The addresses are grouped into runs of consecutive addresses, and each run is read with a single auto-incrementing address set, all in one pipelined transfer. Returns a list of integer values in the same order as `addresses`.
+
+            Arguments:
+                addresses (list[int]): The addresses to read from.
+        """
+
+        addresses = list(addresses)
+        values = {}
+
+        # Serve cached registers from the shadow
+        missing = addresses
+        if self.cache is not None:
+            missing = []
+            for address in set(addresses):
+                value = self.cache.lookup(address)
+                if value is None:
+                    missing.append(address)
+                else:
+                    values[address] = value[0]
+
+        t = self.batch()
+        runs = [(base, t.read(base, count)) for base, count in address_runs(missing)]
+        t.execute()
+
+        for base, result in runs:
+            for i, value in enumerate(result.value):
+                values[base + i] = value
+
+        return [values[address] for address in addresses]
+
+    def write_many(self, values):
+        """
+            Write each value in `values` (a mapping of address to value) to its address. The addresses are grouped into runs of consecutive addresses, and each run is written with a single auto-incrementing address set, all in one pipelined transfer.
+
+            Arguments:
+                values (dict[int, int]): The values to write, keyed by address.
+        """
+
+        t = self.batch()
+        for base, count in address_runs(values.keys()):
+            t.write(base, [values[base + i] for i in range(count)])
+        t.execute()
+
+    def modify(self, address, mask, value):
+        """
+            Read-modify-write the 32-bit word at `address`: the bits set in `mask` are replaced by those of `value`, and the other bits are kept. Returns the previous value of the word.
+
+            Arguments:
+                address (int): The address to modify.
+                mask (int): The bits to change.
+                value (int): The new value of the bits in `mask`.
+        """
+
+        return self.modify_many({address: (mask, value)})[address]
+
+    def set_bits(self, address, mask):
+        """
+            Set the bits in `mask` in the 32-bit word at `address`, keeping the other bits. Returns the previous value of the word.
+
+            Arguments:
+                address (int): The address to modify.
+                mask (int): The bits to set.
+        """
+
+        return self.modify(address, mask, mask)
+
+    def clear_bits(self, address, mask):
+        """
+            Clear the bits in `mask` in the 32-bit word at `address`, keeping the other bits. Returns the previous value of the word.
+
+            Arguments:
+                address (int): The address to modify.
+                mask (int): The bits to clear.
+        """
+
+        return self.modify(address, mask, 0)
+
+    def modify_many(self, updates):
+        """
+            Read-modify-write many 32-bit words, as with modify(). All words are read in one pipelined transfer (see read_many()), and all updated values are written in a second one (see write_many()), so the cost does not grow with the number of round trips. As with read_many(), the previous values of cached words are taken from the cache. Returns a dictionary of the previous value of each word, keyed by address.
+
+            Arguments:
+                updates (dict[int, tuple]): The (mask, value) to apply to each word, keyed by address.
+        """
+
+        addresses = list(updates.keys())
+        previous = dict(zip(addresses, self.read_many(addresses)))
+
+        values = {}
+        for address, (mask, value) in updates.items():
+            mask &= 0xffffffff
+            values[address] = (previous[address] & ~mask) | (value & mask)
+
+        self.write_many(values)
+        return previous
+
+    def dump(self, address, n, path, big_endian=False, offset=0, progress=None, chunk_words=4096):
+        """
+            Read `n` contiguous 32-bit words starting at `address` into the file at `path`, as raw 4-byte words. The file is memory-mapped and filled as the data arrives, so memory use does not grow with `n`. An existing file is replaced. An interrupted dump can be resumed by passing the number of words already completed as `offset`; the existing contents of the file are then kept. Blocks execution until finished or timed out.
+
+            Arguments:
+                address (int): The base address to read from.
+                n (int): The total number of words to dump.
+                path (str): The file to write to. Sized to hold exactly `n` words.
+                big_endian (bool): Whether to store words big-endian (default: little-endian).
+                offset (int): The index of the first word to transfer, for resuming.
+                progress (function): Called as progress(words_done, n) after each chunk.
+                chunk_words (int): The number of words transferred between progress calls.
+        """
+
+        assert 0 <= offset <= n
+        size = 4 * n
+
+        # A fresh dump replaces the file, a resumed one keeps its contents
+        mode = "r+b" if (offset > 0) and os.path.exists(path) else "w+b"
+        with open(path, mode) as f:
+            f.truncate(size)
+
+            if n == offset:
+                return
+
+            swap = big_endian != (sys.byteorder == "big")
+            with mmap.mmap(f.fileno(), size) as mm:
+                pos = 4 * offset
+                for chunk in self.read_stream(address + offset, n - offset, chunk_words=chunk_words):
+                    if swap:
+                        chunk.byteswap()
+                    mm[pos:pos + 4 * len(chunk)] = chunk.tobytes()
+                    pos += 4 * len(chunk)
+
+                    if progress is not None:
+                        progress(pos // 4, n)
+
+                mm.flush()
+
+    def load(self, path, address, big_endian=False, offset=0, n=None, progress=None):
+        """
+            Write the raw 4-byte words stored in the file at `path` into contiguous 32-bit words starting at `address`. The file is memory-mapped and streamed to the bus through the pipelined path, so memory use does not grow with the file size. An interrupted load can be resumed by passing the number of words already completed as `offset`. Blocks execution until finished or timed out.
+
+            Arguments:
+                path (str): The file to read from.
+                address (int): The base address to write to. Word `i` of the file is written to `address + i`.
+                big_endian (bool): Whether words are stored big-endian (default: little-endian).
+                offset (int): The index of the first word to transfer, for resuming.
+                n (int): The total number of words to load (default: the whole file).
+                progress (function): Called as progress(words_done, n) as acknowledgements arrive.
+        """
+
+        with open(path, "rb") as f:
+            total = os.fstat(f.fileno()).st_size // 4
+            n = total if n is None else n
+            assert 0 <= offset <= n <= total
+
+            if n == offset:
+                return
+
+            swap = big_endian != (sys.byteorder == "big")
+            set_frame = encode_frames(CMD_SET_ADDR_INC, [address + offset])
+
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                view = memoryview(mm)
+
+                # Command `i` writes word `offset + i - 1`; command 0 sets the address
+                def render(start, end):
+                    prefix = b""
+                    if start == 0:
+                        prefix = set_frame
+                        start = 1
+
+                    words = array("I")
+                    words.frombytes(view[4 * (offset + start - 1):4 * (offset + end - 1)])
+                    if swap:
+                        words.byteswap()
+
+                    return prefix + encode_frames(CMD_WRITE_REQ, words)
+
+                try:
+                    done = offset
+                    first = True
+                    for opcodes, data in self._pipeline(n - offset + 1, render, "load"):
+                        # Remove address-acknowledge
+                        if first:
+                            assert opcodes[0] == RESP_ADDR_ACK
+                            opcodes = opcodes[1:]
+                            first = False
+
+                        assert opcodes.count(RESP_WRITE_ACK) == len(opcodes)
+                        done += len(opcodes)
+
+                        if progress is not None:
+                            progress(done, n)
+                finally:
+                    view.release()
+
+        if self.cache is not None:
+            self.cache.invalidate(address + offset, n - offset)
+
+    def batch(self):
+        """
+            Create a Transaction for queueing mixed read / write operations, which are sent together as one pipelined command stream. When used as a context manager, the queued operations are executed on exit and each operation's Result is filled in.
+
+            Example:
+                with bus.batch() as b:
+                    status = b.read(0x10)
+                    b.write(0x20, [1, 2, 3])
+                print(status.value)
+        """
+        return Transaction(self)
+
+    def sampler(self, addresses, capacity=65536, trigger=None, pretrigger=0, interval=0):
+        """
+            Create a Sampler which repeatedly reads the words at `addresses` as fast as the link allows, storing each pass as a timestamped row in a ring buffer. Requires NumPy. See Sampler.
+
+            Arguments:
+                addresses (list[int]): The addresses to sample, one column per address.
+                capacity (int): The number of rows the buffer holds.
+                trigger (function OR tuple): A function of a row returning True on the trigger row, or a tuple (address, mask, value).
+                pretrigger (int): The number of rows before the trigger row to keep.
+                interval (float): The minimum time between rows in seconds (0 = back-to-back).
+        """
+        return Sampler(self, addresses, capacity, trigger, pretrigger, interval)
+
     def reset(self):
         """
-            Forcibly reset the bus. Blocks until the bus-reset is acknowledged.
+            Forcibly reset the bus. Blocks until the bus-reset is acknowledged. If the received bytes are misaligned (e.g. after a lost byte), the receive path is resynchronized as well.
         """
-        self.port.write(bytearray(create_instruction(
+        self._write_port(bytearray(create_instruction(
             CMD_BUS_RESET, 0
         )))
 
         while True:
-            inst, data = self._read_data(1)[0]
+            try:
+                opcodes, data = self._read_data(1)
+            except FramingError:
+                self._resync()
+                return
             
-            if inst == RESP_BUS_RESET:
+            if opcodes[0] == RESP_BUS_RESET:
                 return
 
     def poll_interrupts(self, reset=False):
@@ -251,29 +1322,78 @@ class DebugBus:
 
         return ret
 
-    def poll_interrupts(self, reset=False):
+    def reset_interrupts(self):
         """
-            Poll the received interrupts. Returns an array of the 4 interrupts.
-            
+            Reset interrupts regardless of whether they have been polled.
+        """
+        self.interrupts = [False, False, False, False]
+
+    def on_interrupt(self, n, callback):
+        """
+            Register a function to be called as callback(n, timestamp) whenever interrupt `n` is received, where `timestamp` is its arrival time in terms of time.monotonic(). With the background reader running, callbacks run on the reader thread as soon as the interrupt arrives; otherwise they run whenever the bus next reads from the port.
+
             Arguments:
-                reset (bool): Whether to reset the interrupts after reading.
+                n (int): The interrupt number (1-4).
+                callback (function): The function to call.
         """
+        self.interrupt_callbacks[n - 1].append(callback)
 
-        self._read_port()
+    def remove_interrupt_callback(self, n, callback):
+        """
+            Unregister a callback added with on_interrupt().
+        """
+        self.interrupt_callbacks[n - 1].remove(callback)
 
-        ret = self.interrupts[:]
-        if reset:
-            self.reset_interrupts()
+    def wait_for_interrupt(self, n, timeout=None, reset=True):
+        """
+            Block until interrupt `n` has been received (returns immediately if it already has, and has not been reset since). Returns the arrival time of the most recent occurrence (in terms of time.monotonic()), or None if `timeout` seconds pass first.
 
-        return ret
+            Arguments:
+                n (int): The interrupt number (1-4).
+                timeout (float): The maximum number of seconds to wait, or None to wait forever.
+                reset (bool): Whether to reset this interrupt after it is received.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
 
-    def reset_interrupts(self):
+        while True:
+            self._read_port()
+
+            with self.rx_lock:
+                if self.interrupts[n - 1]:
+                    if reset:
+                        self.interrupts[n - 1] = False
+                    return self.interrupt_times[n - 1]
+
+            if (deadline is not None) and (time.monotonic() > deadline):
+                return None
+
+            self._wait_port(deadline)
+
+    def start_trace(self, path, capacity=16 << 20):
         """
-            Reset interrupts regardless of whether they have been polled.
+            Start recording every chunk of bytes sent to and received from the port, with timestamps, into the trace file at `path`. The file is a memory-mapped ring buffer: once `capacity` bytes of records have been written, the oldest are overwritten. Use read_trace() / decode_trace() or the wbdbgbus-trace script to inspect it, and ReplayPort to play it back. Returns the TraceRecorder.
+
+            Arguments:
+                path (str): The trace file to create.
+                capacity (int): The size of the ring buffer in bytes.
         """
-        self.interrupts = [False, False, False, False]
+        self.stop_trace()
+        self.trace = TraceRecorder(path, capacity)
+        return self.trace
+
+    def stop_trace(self):
+        """
+            Stop recording the trace started with start_trace(), if any, and close the file.
+        """
+        if self.trace is None:
+            return
+
+        trace, self.trace = self.trace, None
+        trace.close()
 
     def close(self):
+        self.stop_reader()
+        self.stop_trace()
         self.port.close()
 
     # Context manager compliance
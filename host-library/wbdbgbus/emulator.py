@@ -0,0 +1,323 @@
+import os
+import time
+import random
+import select
+import threading
+from collections import deque
+from .utils import *
+from .model import DeviceModel, WishboneError
+
+"""
+    Cycle-approximate software emulator of the wbdbgbus device, for running
+    the host library without an FPGA (e.g. for benchmarks and CI). Extends
+    DeviceModel with the timing of the real device:
+
+        - bytes from the host arrive at the UART's byte rate, and a partial
+          frame is dropped if no byte arrives for `drop_time` seconds
+          (DROP_CLKS)
+        - commands wait in a command FIFO of `fifo_depth` entries and are
+          dropped when it is full; a bus reset bypasses it and flushes both
+          FIFOs
+        - the bus master executes one command at a time, taking a number of
+          clock cycles per command plus any injected Wishbone stall cycles
+        - responses wait in a response FIFO of `fifo_depth` entries (dropped
+          when full) and are transmitted at the UART's byte rate, with
+          pending interrupts sent first at each frame boundary
+        - optionally, bytes are lost on the line in either direction with a
+          probability of `loss_rate` each
+
+    Emulated time follows the wall clock, and a background thread runs the
+    device as events fall due. Connect the host either in-process through a
+    LoopbackTransport, or through a pseudo-terminal with attach_pty().
+"""
+class Emulator(DeviceModel):
+
+    # Clock cycles to pass a command through the FIFOs and the bus master
+    # (excluding the Wishbone access itself), and for a Wishbone access
+    COMMAND_CLOCKS = 8
+    ACCESS_CLOCKS = 2
+
+    def __init__(self, baud=115200, fifo_depth=128, clk_freq=25000000, drop_clks=2500000,
+                 bits_per_byte=10, memory=None, errors=(), stalls=None, error_rate=0.0, loss_rate=0.0,
+                 seed=None):
+        DeviceModel.__init__(self, memory, errors)
+
+        # Seconds per UART byte (0 = no pacing) and per clock cycle
+        self.byte_time = (bits_per_byte / baud) if baud else 0.0
+        self.clock_time = 1 / clk_freq
+        self.drop_time = drop_clks / clk_freq
+        self.fifo_depth = fifo_depth
+
+        # Injected Wishbone stall cycles per address, and the probability of
+        # any access failing with a bus error
+        self.stalls = {} if stalls is None else stalls
+        self.error_rate = error_rate
+        self.loss_rate = loss_rate
+        self.random = random.Random(seed)
+
+        # Statistics
+        self.dropped_frames = 0
+        self.dropped_commands = 0
+        self.dropped_responses = 0
+        self.lost_bytes = 0
+
+        self.cond = threading.Condition()
+
+        # Receiver: time the last scheduled byte has arrived, and the arrival
+        # time of the last byte of the partial frame
+        self.rx_free = 0.0
+        self.rx_last = 0.0
+
+        # Complete frames not yet processed: (arrival time, opcode, word)
+        self.arrivals = deque()
+
+        self.cmd_fifo = deque()
+        self.resp_fifo = deque()
+
+        # Response of the command in progress and when it completes
+        self.master_busy = False
+        self.master_done = 0.0
+        self.master_response = None
+
+        # Frame being transmitted and when it completes
+        self.tx_frame = None
+        self.tx_done = 0.0
+        self.pending_interrupts = [False, False, False, False]
+
+        # Completed frames not yet passed to transmit()
+        self.tx_out = []
+
+        self.pty = None
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    # Wishbone stall cycles for an access to `address`, may be overridden
+    def stall_cycles(self, address, write):
+        return self.stalls.get(address, 0)
+
+    def bus_read(self, address):
+        if self.error_rate and (self.random.random() < self.error_rate):
+            raise WishboneError()
+
+        return DeviceModel.bus_read(self, address)
+
+    def bus_write(self, address, value):
+        if self.error_rate and (self.random.random() < self.error_rate):
+            raise WishboneError()
+
+        DeviceModel.bus_write(self, address, value)
+
+    def receive(self, data):
+        """
+            Feed bytes sent by the host into the emulator. The bytes arrive at the device at the UART's byte rate, after any bytes still arriving from earlier calls.
+
+            Arguments:
+                data (bytes): The bytes received from the host.
+        """
+        if len(data) == 0:
+            return
+
+        with self.cond:
+            data = self._lose(data)
+            if len(data) == 0:
+                return
+
+            start = max(time.monotonic(), self.rx_free)
+
+            # Drop the partial frame if the line was idle for too long
+            if self.frame and (start + self.byte_time - self.rx_last > self.drop_time):
+                self.frame.clear()
+                self.dropped_frames += 1
+
+            partial = len(self.frame)
+            self.frame.extend(data)
+            n = len(self.frame) // FRAME_SIZE
+
+            if n > 0:
+                opcodes, words = decode_frames(bytes(self.frame[0:n * FRAME_SIZE]))
+                del self.frame[0:n * FRAME_SIZE]
+
+                # Frame `i` is complete when its last byte has arrived
+                frame_time = FRAME_SIZE * self.byte_time
+                first = start + (FRAME_SIZE - partial) * self.byte_time
+                for i in range(n):
+                    self.arrivals.append((first + i * frame_time, opcodes[i], words[i]))
+
+            self.rx_free = start + len(data) * self.byte_time
+            self.rx_last = self.rx_free
+            self.cond.notify_all()
+
+    def interrupt(self, n):
+        """
+            Raise interrupt `n` (1-4). Its frame is transmitted at the next frame boundary, ahead of any queued responses.
+
+            Arguments:
+                n (int): The interrupt number (1-4).
+        """
+        with self.cond:
+            now = time.monotonic()
+            self._advance(now)
+            self.pending_interrupts[n - 1] = True
+            self._start(now)
+            self.cond.notify_all()
+
+        self._flush()
+
+    # Returns `data` with bytes lost according to `loss_rate`
+    def _lose(self, data):
+        if not self.loss_rate:
+            return data
+
+        kept = bytes(b for b in data if self.random.random() >= self.loss_rate)
+        self.lost_bytes += len(data) - len(kept)
+        return kept
+
+    # Time of the next event, or None if idle
+    def _next_event(self):
+        times = []
+        if self.arrivals:
+            times.append(self.arrivals[0][0])
+        if self.master_busy:
+            times.append(self.master_done)
+        if self.tx_frame is not None:
+            times.append(self.tx_done)
+
+        return min(times) if times else None
+
+    # Start the bus master and the transmitter at time `t` if they are idle
+    def _start(self, t):
+        if (not self.master_busy) and self.cmd_fifo:
+            opcode, word = self.cmd_fifo.popleft()
+            address = self.address
+            clocks = self.COMMAND_CLOCKS
+
+            self.master_response = self.execute(opcode, word)
+            if opcode in (CMD_READ_REQ, CMD_WRITE_REQ):
+                clocks += self.ACCESS_CLOCKS + self.stall_cycles(address, opcode == CMD_WRITE_REQ)
+
+            self.master_busy = True
+            self.master_done = t + clocks * self.clock_time
+
+        if self.tx_frame is None:
+            frame = None
+            for i in range(4):
+                if self.pending_interrupts[i]:
+                    self.pending_interrupts[i] = False
+                    frame = (RESP_INTERRUPT_ALL[i], 0)
+                    break
+
+            if (frame is None) and self.resp_fifo:
+                frame = self.resp_fifo.popleft()
+
+            if frame is not None:
+                self.tx_frame = frame
+                self.tx_done = t + FRAME_SIZE * self.byte_time
+
+    # Process all events due by `now`
+    def _advance(self, now):
+        while True:
+            t = self._next_event()
+            if (t is None) or (t > now):
+                return
+
+            if self.arrivals and (self.arrivals[0][0] == t):
+                arrival, opcode, word = self.arrivals.popleft()
+                if opcode == CMD_BUS_RESET:
+                    # Abort everything in progress; the frame being
+                    # transmitted is still completed
+                    self.cmd_fifo.clear()
+                    self.resp_fifo.clear()
+                    self.master_busy = False
+                    self.resp_fifo.append((RESP_BUS_RESET, 0))
+
+                elif len(self.cmd_fifo) < self.fifo_depth:
+                    self.cmd_fifo.append((opcode, word))
+
+                else:
+                    self.dropped_commands += 1
+
+            elif self.master_busy and (self.master_done == t):
+                self.master_busy = False
+                if self.master_response is not None:
+                    if len(self.resp_fifo) < self.fifo_depth:
+                        self.resp_fifo.append(self.master_response)
+                    else:
+                        self.dropped_responses += 1
+
+            elif (self.tx_frame is not None) and (self.tx_done == t):
+                self.tx_out.append(self.tx_frame)
+                self.tx_frame = None
+
+            self._start(t)
+
+    # Pass completed frames to the host
+    def _flush(self):
+        with self.cond:
+            frames, self.tx_out = self.tx_out, []
+            if frames:
+                data = self._lose(encode_frames([f[0] for f in frames], [f[1] for f in frames]))
+
+        if frames and data:
+            self.transmit(data)
+
+    # Body of the device thread
+    def _run(self):
+        while self.running:
+            with self.cond:
+                self._advance(time.monotonic())
+
+            self._flush()
+
+            with self.cond:
+                if not self.running:
+                    return
+
+                # Sleep until the next event, or until new input arrives
+                t = self._next_event()
+                if t is None:
+                    self.cond.wait(0.1)
+                elif t > time.monotonic():
+                    self.cond.wait(t - time.monotonic())
+
+    def attach_pty(self):
+        """
+            Create a pseudo-terminal connected to the emulator, so that it can be opened by name like a serial port (POSIX only). Returns the device name of the pseudo-terminal.
+        """
+        import tty
+
+        master, slave = os.openpty()
+        tty.setraw(slave)
+        self.pty = (master, slave)
+        self.transmit = lambda data: os.write(master, data)
+
+        threading.Thread(target=self._pty_loop, args=(master,), daemon=True).start()
+        return os.ttyname(slave)
+
+    # Body of the thread forwarding bytes from the pseudo-terminal
+    def _pty_loop(self, master):
+        while self.running:
+            if not select.select([master], [], [], 0.1)[0]:
+                continue
+
+            try:
+                data = os.read(master, 65536)
+            except OSError:
+                return
+
+            self.receive(data)
+
+    def close(self):
+        """
+            Stop the emulator and close its pseudo-terminal, if any.
+        """
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+
+        self.thread.join()
+
+        if self.pty is not None:
+            for fd in self.pty:
+                os.close(fd)
+            self.pty = None
@@ -0,0 +1,325 @@
+import time
+from .utils import *
+
+# Command opcodes counted separately in the transmit statistics
+COMMAND_NAMES = {
+    CMD_READ_REQ: "read",
+    CMD_WRITE_REQ: "write",
+    CMD_SET_ADDR: "set_addr",
+    CMD_SET_ADDR_INC: "set_addr_inc",
+    CMD_BUS_RESET: "bus_reset",
+}
+
+# Response opcodes counted separately in the receive statistics
+RESPONSE_NAMES = {
+    RESP_READ_RESP: "read_resp",
+    RESP_WRITE_ACK: "write_ack",
+    RESP_ADDR_ACK: "addr_ack",
+    RESP_BUS_ERROR: "bus_error",
+    RESP_BUS_RESET: "bus_reset",
+    RESP_INTERRUPT_1: "interrupt_1",
+    RESP_INTERRUPT_2: "interrupt_2",
+    RESP_INTERRUPT_3: "interrupt_3",
+    RESP_INTERRUPT_4: "interrupt_4",
+}
+
+"""
+    Histogram of durations with power-of-two buckets, from 1 us up to about
+    an hour. Bucket `i` counts durations below 2**i microseconds (and at
+    least 2**(i-1)).
+"""
+class Histogram:
+
+    NUM_BUCKETS = 32
+
+    def __init__(self):
+        self.buckets = [0] * self.NUM_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, seconds):
+        index = min(int(seconds * 1e6).bit_length(), self.NUM_BUCKETS - 1)
+        self.buckets[index] += 1
+        self.count += 1
+        self.total += seconds
+
+        if (self.min is None) or (seconds < self.min):
+            self.min = seconds
+        if (self.max is None) or (seconds > self.max):
+            self.max = seconds
+
+    def mean(self):
+        return (self.total / self.count) if self.count else None
+
+    def percentile(self, p):
+        """
+            Returns an upper bound (the top of the bucket) for the `p`th percentile duration in seconds, or None if nothing has been recorded.
+        """
+        if self.count == 0:
+            return None
+
+        target = p / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if (n > 0) and (seen >= target):
+                return min((1 << i) / 1e6, self.max)
+
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean": self.mean(),
+            "min": self.min,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+        }
+
+"""
+    Statistics of one completed transfer, as passed to transfer hooks. Times
+    are in seconds; `wait_time`, `encode_time` and `decode_time` are the parts
+    of `duration` spent blocked on the port, rendering command frames and
+    decoding response frames.
+"""
+class TransferRecord:
+
+    def __init__(self, op, frames, words, duration, wait_time, encode_time, decode_time):
+        self.op = op
+        self.frames = frames
+        self.words = words
+        self.duration = duration
+        self.wait_time = wait_time
+        self.encode_time = encode_time
+        self.decode_time = decode_time
+
+    def __repr__(self):
+        return "TransferRecord({}, {} frames, {:.6f}s)".format(self.op, self.frames, self.duration)
+
+"""
+    Transport statistics of a DebugBus: bytes and frames on the wire, latency
+    histograms, where the host's time goes, and how full the pipeline is kept.
+    Used to tell a slow device, a slow link (e.g. USB latency timers) and host
+    overhead apart.
+"""
+class Metrics:
+
+    def __init__(self, baud, window_size, bits_per_byte=10):
+        self.baud = baud
+        self.window_size = window_size
+        self.bits_per_byte = bits_per_byte
+
+        self.hooks = []
+        self.reset()
+
+    def reset(self):
+        """
+            Clear all statistics.
+        """
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.frames_sent = dict.fromkeys(COMMAND_NAMES.values(), 0)
+        self.frames_received = dict.fromkeys(RESPONSE_NAMES.values(), 0)
+
+        # Transfer latency per operation type, and the time from sending a
+        # window of commands until its first response arrives
+        self.latency = {}
+        self.rtt = Histogram()
+
+        self.transfers = 0
+        self.transfer_time = 0.0
+        self.transfer_words = 0
+        self.wait_time = 0.0
+        self.encode_time = 0.0
+        self.decode_time = 0.0
+
+        # Commands in flight, sampled each time the window is topped up
+        self.window_samples = 0
+        self.window_total = 0
+        self.window_max = 0
+
+        # Recoveries from framing errors (lost or corrupted bytes)
+        self.resyncs = 0
+
+    # Record a chunk of encoded command frames written to the port
+    def sent(self, chunk):
+        self.bytes_sent += len(chunk)
+
+        opcodes = bytes(chunk[0::FRAME_SIZE])
+        for opcode, name in COMMAND_NAMES.items():
+            self.frames_sent[name] += opcodes.count(opcode)
+
+    # Record `nbytes` received from the port, decoding into `opcodes`
+    def received(self, opcodes, nbytes):
+        self.bytes_received += nbytes
+
+        if len(opcodes) == 0:
+            return
+
+        for opcode, name in RESPONSE_NAMES.items():
+            self.frames_received[name] += opcodes.count(opcode)
+
+    # Record the number of commands in flight after topping up the window
+    def window(self, in_flight):
+        self.window_samples += 1
+        self.window_total += in_flight
+        if in_flight > self.window_max:
+            self.window_max = in_flight
+
+    # Returns the state at the start of a transfer, for end_transfer()
+    def begin_transfer(self):
+        return (time.perf_counter(), self.wait_time, self.encode_time, self.decode_time, self._data_frames())
+
+    # Read and write commands sent so far
+    def _data_frames(self):
+        return self.frames_sent["read"] + self.frames_sent["write"]
+
+    # Record a finished transfer of `frames` commands and run the hooks
+    def end_transfer(self, op, frames, state):
+        start, wait_time, encode_time, decode_time, data_frames = state
+        duration = time.perf_counter() - start
+        words = self._data_frames() - data_frames
+
+        self.transfers += 1
+        self.transfer_time += duration
+        self.transfer_words += words
+
+        if op not in self.latency:
+            self.latency[op] = Histogram()
+        self.latency[op].record(duration)
+
+        if self.hooks:
+            record = TransferRecord(
+                op, frames, words, duration,
+                self.wait_time - wait_time,
+                self.encode_time - encode_time,
+                self.decode_time - decode_time
+            )
+            for hook in self.hooks:
+                hook(record)
+
+    def add_hook(self, callback):
+        """
+            Register a function to be called as callback(record) with a TransferRecord after each transfer completes.
+
+            Arguments:
+                callback (function): The function to call.
+        """
+        self.hooks.append(callback)
+
+    def remove_hook(self, callback):
+        """
+            Unregister a hook added with add_hook().
+        """
+        self.hooks.remove(callback)
+
+    def words_per_second(self):
+        """
+            Returns the achieved rate of data words (reads and writes) while transfers were running, or None before any transfer.
+        """
+        if self.transfer_time == 0:
+            return None
+
+        return self.transfer_words / self.transfer_time
+
+    def baud_limit(self):
+        """
+            Returns the theoretical maximum words/s of the link, at one 5-byte frame per word in each direction.
+        """
+        return self.baud / (FRAME_SIZE * self.bits_per_byte)
+
+    def efficiency(self):
+        """
+            Returns the achieved words/s as a fraction of baud_limit(), or None before any transfer.
+        """
+        rate = self.words_per_second()
+        return None if rate is None else rate / self.baud_limit()
+
+    def window_occupancy(self):
+        """
+            Returns the mean number of commands in flight as a fraction of the window size, or None before any transfer.
+        """
+        if self.window_samples == 0:
+            return None
+
+        return self.window_total / self.window_samples / self.window_size
+
+    def summary(self):
+        """
+            Returns all statistics as a dictionary (suitable for JSON).
+        """
+        other_time = self.transfer_time - self.wait_time - self.encode_time - self.decode_time
+
+        return {
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "frames_sent": dict(self.frames_sent),
+            "frames_received": dict(self.frames_received),
+            "transfers": self.transfers,
+            "words": self.transfer_words,
+            "latency": {op: h.summary() for op, h in self.latency.items()},
+            "rtt": self.rtt.summary(),
+            "time": {
+                "transfer": self.transfer_time,
+                "wait": self.wait_time,
+                "encode": self.encode_time,
+                "decode": self.decode_time,
+                "other": max(0.0, other_time),
+            },
+            "window_size": self.window_size,
+            "window_mean": (self.window_total / self.window_samples) if self.window_samples else None,
+            "window_max": self.window_max,
+            "window_occupancy": self.window_occupancy(),
+            "words_per_second": self.words_per_second(),
+            "baud_limit": self.baud_limit(),
+            "efficiency": self.efficiency(),
+            "resyncs": self.resyncs,
+        }
+
+    def report(self):
+        """
+            Returns a human-readable summary of the statistics.
+        """
+        s = self.summary()
+
+        def ms(x):
+            return "-" if x is None else "{:.3f} ms".format(x * 1e3)
+
+        def pct(x):
+            return "-" if x is None else "{:.1f}%".format(x * 100)
+
+        lines = []
+        lines.append("Sent {} bytes, received {} bytes in {} transfers ({} words)".format(
+            s["bytes_sent"], s["bytes_received"], s["transfers"], s["words"]))
+        lines.append("Frames sent: " + ", ".join(
+            "{} {}".format(k, v) for k, v in s["frames_sent"].items() if v))
+        lines.append("Frames received: " + ", ".join(
+            "{} {}".format(k, v) for k, v in s["frames_received"].items() if v))
+
+        rate = s["words_per_second"]
+        lines.append("Throughput: {} words/s of {:.0f} words/s baud limit ({})".format(
+            "-" if rate is None else "{:.0f}".format(rate), s["baud_limit"], pct(s["efficiency"])))
+
+        t = s["time"]
+        total = t["transfer"]
+        lines.append("Time: {:.3f} s in transfers, waiting {}, encoding {}, decoding {}, other {}".format(
+            total, *(pct(t[k] / total if total else None) for k in ("wait", "encode", "decode", "other"))))
+
+        lines.append("Window: mean {} of {} in flight ({}), max {}".format(
+            "-" if s["window_mean"] is None else "{:.1f}".format(s["window_mean"]),
+            s["window_size"], pct(s["window_occupancy"]), s["window_max"]))
+
+        if s["resyncs"]:
+            lines.append("Resynchronized after framing errors {} times".format(s["resyncs"]))
+
+        for name, h in [("round trip", s["rtt"])] + sorted(s["latency"].items()):
+            if h["count"] == 0:
+                continue
+            lines.append("Latency {}: n={} mean {} p50 {} p99 {} max {}".format(
+                name, h["count"], ms(h["mean"]), ms(h["p50"]), ms(h["p99"]), ms(h["max"])))
+
+        return "\n".join(lines)
@@ -0,0 +1,120 @@
+from .utils import *
+
+"""
+    Raised by a DeviceModel's Wishbone handlers to signal a bus error (the
+    equivalent of i_wb_err).
+"""
+class WishboneError(Exception):
+    pass
+
+"""
+    Pure-Python functional model of the wbdbgbus device (wbdbgbus.sv and
+    wbdbgbusmaster.sv), backed by a simulated Wishbone memory. Commands are
+    executed as soon as their frames are complete and responses are passed to
+    `transmit`, so the model has no notion of time, baud rate or FIFO depth.
+
+    Behaviour follows the RTL: the address register auto-increments after
+    every read or write (including failed ones) when set with
+    CMD_SET_ADDR_INC, a bus error replaces the response of the failing
+    command, unknown commands are ignored, and a bus reset (opcode 0xF) drops
+    the responses not yet transmitted and answers with RESP_BUS_RESET.
+"""
+class DeviceModel:
+
+    def __init__(self, memory=None, errors=()):
+        # Simulated Wishbone memory, unwritten words read as 0
+        self.memory = {} if memory is None else memory
+
+        # Addresses which respond to any access with a bus error
+        self.errors = set(errors)
+
+        self.address = 0
+        self.increment = False
+
+        # Partial frame received so far
+        self.frame = bytearray()
+
+        # Called with the encoded response bytes; by default they are
+        # collected in `output`
+        self.output = bytearray()
+        self.transmit = self.output.extend
+
+    # Wishbone read of one word, may be overridden
+    def bus_read(self, address):
+        if address in self.errors:
+            raise WishboneError()
+
+        return self.memory.get(address, 0)
+
+    # Wishbone write of one word, may be overridden
+    def bus_write(self, address, value):
+        if address in self.errors:
+            raise WishboneError()
+
+        self.memory[address] = value
+
+    # Execute one command, returning the (opcode, word) response or None
+    def execute(self, opcode, word):
+        if opcode in (CMD_SET_ADDR, CMD_SET_ADDR_INC):
+            self.address = word
+            self.increment = opcode == CMD_SET_ADDR_INC
+            return (RESP_ADDR_ACK, 0)
+
+        if opcode not in (CMD_READ_REQ, CMD_WRITE_REQ):
+            return None
+
+        address = self.address
+        if self.increment:
+            self.address = (self.address + 1) & 0xffffffff
+
+        try:
+            if opcode == CMD_READ_REQ:
+                return (RESP_READ_RESP, self.bus_read(address) & 0xffffffff)
+
+            self.bus_write(address, word)
+            return (RESP_WRITE_ACK, 0)
+
+        except WishboneError:
+            return (RESP_BUS_ERROR, 0)
+
+    def receive(self, data):
+        """
+            Feed bytes sent by the host into the model. Complete frames are executed in order and their responses transmitted.
+
+            Arguments:
+                data (bytes): The bytes received from the host.
+        """
+        self.frame.extend(data)
+
+        n = len(self.frame) // FRAME_SIZE
+        if n == 0:
+            return
+
+        opcodes, words = decode_frames(bytes(self.frame[0:n * FRAME_SIZE]))
+        del self.frame[0:n * FRAME_SIZE]
+
+        out = []
+        for opcode, word in zip(opcodes, words):
+            if opcode == CMD_BUS_RESET:
+                # Responses not yet transmitted are flushed
+                out = [(RESP_BUS_RESET, 0)]
+                continue
+
+            response = self.execute(opcode, word)
+            if response is not None:
+                out.append(response)
+
+        if out:
+            self.transmit(encode_frames([r[0] for r in out], [r[1] for r in out]))
+
+    def close(self):
+        pass
+
+    def interrupt(self, n):
+        """
+            Raise interrupt `n` (1-4), transmitting its interrupt frame to the host.
+
+            Arguments:
+                n (int): The interrupt number (1-4).
+        """
+        self.transmit(encode_frames(RESP_INTERRUPT_ALL[n - 1], [0]))
@@ -0,0 +1,97 @@
+from .utils import FRAME_SIZE
+
+"""
+    Estimates the time cost of bus operations for planning transfers. Costs
+    are in seconds and count both the command and response frame on the wire.
+"""
+class CostModel:
+
+    def __init__(self, baud, bits_per_byte=10, read_time=0.0, addr_set_time=0.0):
+        self.baud = baud
+
+        # UART bits per byte (8N1 framing = 10 bits)
+        self.bits_per_byte = bits_per_byte
+
+        # Extra time (beyond the wire) for a bus read and for an address set
+        self.read_time = read_time
+        self.addr_set_time = addr_set_time
+
+    # Wire time of one command plus its response
+    def frame_pair_time(self):
+        return 2 * FRAME_SIZE * self.bits_per_byte / self.baud
+
+    # Cost of stepping over `gap` words by issuing read requests
+    def skip_time(self, gap):
+        return gap * (self.frame_pair_time() + self.read_time)
+
+    # Cost of jumping over a gap with a fresh address set
+    def jump_time(self):
+        return self.frame_pair_time() + self.addr_set_time
+
+"""
+    Planned execution of a sparse write. Each segment is (address, data),
+    where `None` entries in data are stepped over with read requests.
+"""
+class WritePlan:
+
+    def __init__(self, segments, cost, frames):
+        self.segments = segments
+        self.cost = cost
+        self.frames = frames
+
+    def __repr__(self):
+        return "WritePlan({} segments, {} frames, {:.6f}s)".format(
+            len(self.segments), self.frames, self.cost
+        )
+
+"""
+    Plan a write of `data` (which may contain `None` holes) starting at
+    `address`. For each hole, the cheaper of skipping it with read requests or
+    restarting with a new address set is chosen according to `model`. Leading
+    and trailing holes are dropped. Returns a WritePlan.
+"""
+def plan_write(address, data, model):
+    segments = []
+    cost = 0.0
+    frames = 0
+
+    i = 0
+    n = len(data)
+    while i < n:
+        # Start a segment at the next value to write
+        while i < n and data[i] is None:
+            i += 1
+        if i == n:
+            break
+
+        start = i
+        segment = []
+        cost += model.jump_time()
+        frames += 1
+
+        while i < n:
+            if data[i] is not None:
+                segment.append(data[i])
+                cost += model.frame_pair_time()
+                frames += 1
+                i += 1
+                continue
+
+            gap_end = i
+            while gap_end < n and data[gap_end] is None:
+                gap_end += 1
+            gap = gap_end - i
+
+            # Trailing hole, or a new address set is no more expensive
+            if (gap_end == n) or (model.jump_time() <= model.skip_time(gap)):
+                i = gap_end
+                break
+
+            segment.extend([None] * gap)
+            cost += model.skip_time(gap)
+            frames += gap
+            i = gap_end
+
+        segments.append(((address + start) & 0xffffffff, segment))
+
+    return WritePlan(segments, cost, frames)
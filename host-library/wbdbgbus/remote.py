@@ -0,0 +1,251 @@
+import math
+import time
+import socket
+from collections import deque
+from .utils import *
+from .debug_bus import DebugBus
+from .server import *
+from .trace import TRACE_TX, TRACE_RX
+
+"""
+    Client for a bus shared by a BusServer. Provides the same API as DebugBus,
+    but sends its command streams to the server over a Unix domain socket
+    instead of opening the serial port itself.
+"""
+class RemoteDebugBus(DebugBus):
+
+    # Number of frames sent per request when streaming, and when the stream
+    # has a time limit (which is checked between requests)
+    STREAM_FRAMES = 4096
+    LIMITED_FRAMES = 64
+
+    def __init__(self, socket_path, timeout=0, prerender=False):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(socket_path)
+        self.sock.settimeout(timeout if timeout != 0 else None)
+
+        self._send(MSG_INFO)
+        baud, fifo_size = INFO_PAYLOAD.unpack(self._recv_reply(INFO_PAYLOAD.size))
+
+        DebugBus.__init__(self, socket_path, baud, fifo_size, timeout=timeout, prerender=prerender)
+
+        # Interrupt counts last reported by the server; only interrupts after
+        # connecting are reported to this client
+        self.remote_counts = self._fetch_interrupts()[0]
+
+    def _open_port(self, serial_port, baud):
+        return self.sock
+
+    def _send(self, msg, flags=0, frames=b""):
+        self.sock.sendall(REQUEST_HEADER.pack(msg, flags, len(frames) // FRAME_SIZE) + frames)
+
+    def _recv_exact(self, size):
+        data = bytearray()
+        while len(data) < size:
+            try:
+                chunk = self.sock.recv(size - len(data))
+            except socket.timeout:
+                raise TimeoutError("Bus server not responding")
+
+            if not chunk:
+                raise ConnectionError("Bus server closed the connection")
+            data.extend(chunk)
+
+        return bytes(data)
+
+    # Receive one reply and return its payload, raising on error statuses
+    # `size` is the payload size of a successful reply (None = from header)
+    def _recv_reply(self, size=None):
+        status, n = REPLY_HEADER.unpack(self._recv_exact(REPLY_HEADER.size))
+
+        if status != STATUS_OK:
+            message = self._recv_exact(n).decode("utf-8")
+            if status == STATUS_BUS_ERROR:
+                raise RuntimeError(message)
+            elif status == STATUS_TIMEOUT:
+                raise TimeoutError(message)
+            else:
+                raise ConnectionError(message)
+
+        return self._recv_exact(n * FRAME_SIZE if size is None else size)
+
+    # The server pipelines each request, so a stream is sent as a sequence
+    # of requests, which take their turn with other clients' transfers
+    # Each request starts with the address set restoring the stream's
+    # position (see DebugBus._restore_address()), whose response is dropped
+    # The next request is sent before waiting for the previous reply, so the
+    # server always has the next part of the stream at hand
+    # Paced commands (see DebugBus._pipeline()) are sent as requests holding
+    # the commands released so far
+    # The server reports bus errors as a status, so they cannot be kept
+    # among the responses (bus_errors)
+    def _pipeline(self, n, render, op="transfer", interval=0, end_time=None, bus_errors=False):
+        assert not bus_errors
+        sent = 0
+        received = 0
+        outstanding = 0
+        addr_sets = deque()
+        restored = deque()
+        state = self.metrics.begin_transfer()
+        start_time = time.monotonic()
+        frames = self.STREAM_FRAMES if end_time is None else self.LIMITED_FRAMES
+
+        try:
+            while sent < n or outstanding > 0:
+                if (end_time is not None) and (time.monotonic() > end_time):
+                    self._abort_stream(outstanding)
+                    raise TimeoutError("Transfer not finished in time")
+
+                # Collect outstanding replies rather than sleeping until the
+                # next paced command is due
+                delay = 0
+                if interval and (sent < n):
+                    delay = start_time + (sent - 1) * interval - time.monotonic()
+                    if (delay > 0) and (outstanding == 0):
+                        if end_time is not None:
+                            delay = min(delay, end_time - time.monotonic())
+                        time.sleep(max(0, delay))
+                        continue
+
+                if (sent < n) and (delay <= 0):
+                    end = min(n, sent + frames)
+                    if interval:
+                        end = min(end, 2 + int((time.monotonic() - start_time) / interval))
+
+                    chunk = self._encode(render, sent, end)
+                    self._track_commands(chunk, sent, bytearray(), addr_sets)
+                    prefix = self._restore_address(addr_sets, sent)
+                    while len(addr_sets) > 1:
+                        addr_sets.popleft()
+
+                    self._send_frames(prefix + chunk)
+                    restored.append(len(prefix) > 0)
+                    sent = end
+                    outstanding += 1
+
+                    # Keep one request queued ahead of the one being answered
+                    if outstanding < 2 and sent < n:
+                        continue
+
+                outstanding -= 1
+                opcodes, data = self._recv_frames()
+                if restored.popleft():
+                    opcodes, data = opcodes[1:], data[1:]
+                received += len(opcodes)
+                yield opcodes, data
+
+        # Replies to requests already sent must still be read, so the next
+        # transfer gets its own
+        except (GeneratorExit, RuntimeError, ConnectionError):
+            self._abort_stream(outstanding)
+            raise
+
+        finally:
+            self.metrics.end_transfer(op, received, state)
+
+    # Discard the replies to `outstanding` requests of a stream which is cut
+    # short
+    def _abort_stream(self, outstanding):
+        for i in range(outstanding):
+            try:
+                self._recv_reply()
+            except RuntimeError:
+                pass
+
+    # Render frames [start, end), recording the time taken
+    def _encode(self, render, start, end):
+        t = time.perf_counter()
+        frames = bytes(render(start, end))
+        self.metrics.encode_time += time.perf_counter() - t
+        return frames
+
+    def _send_frames(self, frames):
+        self._send(MSG_TRANSFER, 0, frames)
+        self.metrics.sent(frames)
+
+        if self.trace is not None:
+            self.trace.record(TRACE_TX, frames)
+
+    # Receive the response frames of one transfer request
+    # Returns (opcode_array, data_array)
+    def _recv_frames(self):
+        # Time spent on the server counts as waiting on the port
+        start = time.perf_counter()
+        payload = self._recv_reply()
+        self.metrics.wait_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        opcodes, data = decode_frames(payload)
+        self.metrics.received(opcodes, len(payload))
+
+        if self.trace is not None:
+            self.trace.record(TRACE_RX, payload)
+        self.metrics.decode_time += time.perf_counter() - start
+
+        return opcodes, data
+
+    def _transfer(self, cmds, words, op="transfer", bus_errors=False):
+        assert not bus_errors
+        if len(cmds) <= self.STREAM_FRAMES:
+            state = self.metrics.begin_transfer()
+            self._send_frames(self._encode(self._render(cmds, words), 0, len(cmds)))
+            response = self._recv_frames()
+            self.metrics.end_transfer(op, len(cmds), state)
+            return response
+
+        return DebugBus._transfer(self, cmds, words, op)
+
+    # Returns the server's interrupt (counts, last arrival times)
+    def _fetch_interrupts(self):
+        self._send(MSG_INTERRUPTS)
+        values = INTERRUPTS_PAYLOAD.unpack(self._recv_reply(INTERRUPTS_PAYLOAD.size))
+        return list(values[0:4]), values[4:8]
+
+    def _read_port(self):
+        counts, times = self._fetch_interrupts()
+
+        fired = []
+        for i in range(4):
+            new = counts[i] - self.remote_counts[i]
+            if new > 0:
+                self.interrupts[i] = True
+                self.interrupt_counts[i] += new
+                self.interrupt_times[i] = None if math.isnan(times[i]) else times[i]
+                self.interrupt_events.append((self.interrupt_times[i], i + 1))
+                fired.append(i)
+
+        self.remote_counts = counts
+
+        for i in fired:
+            for callback in self.interrupt_callbacks[i]:
+                callback(i + 1, self.interrupt_times[i])
+
+    def _wait_port(self, deadline, nbytes=FRAME_SIZE):
+        # Interrupts are polled from the server
+        timeout = 0.001
+        if deadline is not None:
+            timeout = min(timeout, max(0, deadline - time.monotonic()))
+        time.sleep(timeout)
+
+    def _discard_input(self, quiet=0.05):
+        pass
+
+    def start_reader(self):
+        """
+            Not applicable for a remote bus: the server reads the port continuously.
+        """
+        pass
+
+    def stop_reader(self):
+        pass
+
+    def reset(self):
+        """
+            Forcibly reset the bus. Blocks until the bus-reset is acknowledged.
+        """
+        self._send(MSG_RESET)
+        self._recv_reply()
+
+    def close(self):
+        self.stop_trace()
+        self.sock.close()
@@ -0,0 +1,138 @@
+from array import array
+from .utils import FRAME_SIZE, decode_frames
+
+"""
+    Fixed-capacity byte ring buffer used for the receive path. Storage is
+    preallocated once and accessed through read / write cursors, so bytes are
+    never shifted or re-sliced as frames are consumed.
+"""
+class RingBuffer:
+
+    def __init__(self, size=65536):
+        self.size = size
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+
+        # Absolute cursors, taken modulo `size` when indexing
+        self.read_pos = 0
+        self.write_pos = 0
+
+    def __len__(self):
+        return self.write_pos - self.read_pos
+
+    def free(self):
+        return self.size - len(self)
+
+    # Grow the storage (only when a single burst exceeds the capacity)
+    def _grow(self, needed):
+        size = self.size
+        while size - len(self) < needed:
+            size *= 2
+
+        data = self.peek(len(self))
+        self.view.release()
+        self.size = size
+        self.buffer = bytearray(size)
+        self.buffer[0:len(data)] = data
+        self.view = memoryview(self.buffer)
+        self.write_pos = len(data)
+        self.read_pos = 0
+
+    def write(self, data):
+        n = len(data)
+        if n == 0:
+            return
+
+        if n > self.free():
+            self._grow(n)
+
+        start = self.write_pos % self.size
+        first = min(n, self.size - start)
+        self.view[start:start + first] = data[0:first]
+        if first < n:
+            self.view[0:n - first] = data[first:n]
+
+        self.write_pos += n
+
+    def peek(self, n):
+        """
+            Return the next `n` unread bytes without consuming them. The
+            result is a zero-copy memoryview unless the bytes wrap around the
+            end of the storage.
+        """
+        start = self.read_pos % self.size
+        if start + n <= self.size:
+            return self.view[start:start + n]
+
+        first = self.size - start
+        return bytes(self.view[start:]) + bytes(self.view[0:n - first])
+
+    def consume(self, n):
+        self.read_pos += n
+
+        # Rewind cursors when drained so the buffer stays contiguous
+        if self.read_pos == self.write_pos:
+            self.read_pos = 0
+            self.write_pos = 0
+
+    def pop_frames(self, n=None):
+        """
+            Decode and consume the first `n` frames in the buffer (by default
+            every complete frame). Returns (opcode_array, data_array) as
+            produced by decode_frames().
+        """
+        if n is None:
+            n = len(self) // FRAME_SIZE
+        opcodes, data = decode_frames(self.peek(n * FRAME_SIZE))
+        self.consume(n * FRAME_SIZE)
+        return opcodes, data
+
+    def clear(self):
+        self.read_pos = 0
+        self.write_pos = 0
+
+"""
+    FIFO of decoded responses, stored as parallel compact arrays (opcodes in
+    an array('B'), data words in an array('I')) with a head cursor. Consumed
+    entries are compacted away in bulk rather than per pop.
+"""
+class ResponseQueue:
+
+    def __init__(self):
+        self.opcodes = array("B")
+        self.data = array("I")
+        self.head = 0
+
+    def __len__(self):
+        return len(self.data) - self.head
+
+    def append(self, inst, data):
+        self.opcodes.append(inst)
+        self.data.append(data)
+
+    def extend(self, opcodes, data):
+        self.opcodes.extend(opcodes)
+        self.data.extend(data)
+
+    def pop(self, n):
+        """
+            Remove the oldest `n` responses. Returns (opcode_array, data_array).
+        """
+        start = self.head
+        end = start + n
+        ret = self.opcodes[start:end], self.data[start:end]
+        self.head = end
+
+        if self.head == len(self.data):
+            self.clear()
+        elif self.head > 4096 and self.head * 2 > len(self.data):
+            del self.opcodes[0:self.head]
+            del self.data[0:self.head]
+            self.head = 0
+
+        return ret
+
+    def clear(self):
+        self.opcodes = array("B")
+        self.data = array("I")
+        self.head = 0
@@ -0,0 +1,257 @@
+import time
+import threading
+from .utils import *
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+"""
+    Repeatedly reads a fixed list of addresses (the probes) through a debug
+    bus as fast as the link allows, storing each pass over the probes as a
+    row in a preallocated ring buffer of `capacity` rows, so the bus can be
+    used as a logic analyzer for slow signals. Requires NumPy.
+
+    The reads of all rows form a single pipelined stream (each run of
+    consecutive probe addresses costs one address set per row), so rows are
+    sampled back-to-back rather than once per round trip. Each row is
+    timestamped on the host with the arrival of its last response, which is
+    interpolated from the arrival of the bytes it came with at the link's
+    frame rate.
+
+    Sampling runs in a background thread between start() and stop(), during
+    which the bus must not be used otherwise. Rows are at least `interval`
+    seconds apart (0 = back-to-back). Without a trigger, the buffer keeps the
+    latest `capacity` rows. With a trigger, sampling stops by itself once the
+    buffer holds the trigger row, up to `pretrigger` rows before it and the
+    rows after it. The trigger is either a function called with each row (an
+    array of the probe values) which returns True on the trigger row, or a
+    tuple (address, mask, value) of a probe address and the value its masked
+    bits should have.
+"""
+class Sampler:
+
+    def __init__(self, bus, addresses, capacity=65536, trigger=None, pretrigger=0, interval=0):
+        if np is None:
+            raise ImportError("Sampler requires NumPy")
+
+        self.bus = bus
+        self.addresses = list(addresses)
+        self.capacity = capacity
+        self.trigger = trigger
+        self.pretrigger = pretrigger
+        self.interval = interval
+        assert len(self.addresses) > 0
+        assert 0 <= pretrigger < capacity
+
+        # Runs of consecutive probes, in probe order
+        runs = []
+        for address in self.addresses:
+            if runs and (runs[-1][0] + runs[-1][1] == address):
+                runs[-1][1] += 1
+            else:
+                runs.append([address, 1])
+
+        # Command pattern of one row, and which of its responses hold values
+        self.pattern = b"".join(encode_frames(CMD_SET_ADDR_INC, [base]) + encode_frames(CMD_READ_REQ, [0]) * count
+                                for base, count in runs)
+        self.row_frames = len(self.pattern) // FRAME_SIZE
+        self.value_mask = np.ones(self.row_frames, dtype=bool)
+        pos = 0
+        for base, count in runs:
+            self.value_mask[pos] = False
+            pos += count + 1
+
+        # Time between back-to-back responses on the link
+        self.frame_time = FRAME_SIZE * bus.cost_model.bits_per_byte / bus.baud
+
+        self.times = np.zeros(capacity, dtype=np.float64)
+        self.values = np.zeros((capacity, len(self.addresses)), dtype=np.uint32)
+
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stopping = False
+        self.error = None
+        self._clear()
+
+    # Forget all rows
+    def _clear(self):
+        # Rows sampled in total, and the total row count of the trigger row
+        self.count = 0
+        self.triggered = None
+        self.start_time = None
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    # Returns the index of the first row of `values` (2D) matching the trigger,
+    # or None
+    def _find_trigger(self, values):
+        if callable(self.trigger):
+            for i, row in enumerate(values):
+                if self.trigger(row):
+                    return i
+            return None
+
+        address, mask, value = self.trigger
+        matches = np.flatnonzero((values[:, self.addresses.index(address)] & mask) == value)
+        return int(matches[0]) if len(matches) > 0 else None
+
+    # Store rows in the ring buffer
+    # Returns False once a triggered capture is complete
+    def _store(self, times, values):
+        if (self.trigger is not None) and (self.triggered is None):
+            index = self._find_trigger(values)
+            if index is not None:
+                self.triggered = self.count + index
+
+        if self.triggered is not None:
+            # Rows up to the end of the capture
+            end = self.triggered + self.capacity - self.pretrigger
+            keep = max(0, min(len(times), end - self.count))
+            times = times[0:keep]
+            values = values[0:keep]
+
+        # Only the last `capacity` rows survive
+        n = len(times)
+        skip = max(0, n - self.capacity)
+        with self.lock:
+            start = (self.count + skip) % self.capacity
+            first = min(n - skip, self.capacity - start)
+            self.times[start:start + first] = times[skip:skip + first]
+            self.values[start:start + first] = values[skip:skip + first]
+            self.times[0:n - skip - first] = times[skip + first:n]
+            self.values[0:n - skip - first] = values[skip + first:n]
+            self.count += n
+
+        return (self.triggered is None) or (self.count < self.triggered + self.capacity - self.pretrigger)
+
+    # Body of the sampling thread
+    def _run(self):
+        pattern = self.pattern
+        row_frames = self.row_frames
+        tile = pattern * (self.bus.max_buf // row_frames + 2)
+
+        def render(start, end):
+            offset = (start % row_frames) * FRAME_SIZE
+            return tile[offset:offset + (end - start) * FRAME_SIZE]
+
+        probes = len(self.addresses)
+        pending = np.zeros(0, dtype=np.uint32)
+        received = 0
+        last_arrival = self.start_time
+
+        pipeline = self.bus._pipeline(1 << 48, render, "sample", self.interval / row_frames)
+        try:
+            for opcodes, data in pipeline:
+                # Responses arrive back-to-back up to the latest bytes, unless
+                # they were spread out more than that
+                arrival = self.bus.rx_time
+                if arrival <= last_arrival:
+                    arrival = time.monotonic()
+                k = len(data)
+                spacing = min(self.frame_time, (arrival - last_arrival) / k)
+                last_arrival = arrival
+
+                positions = (received + np.arange(k)) % row_frames
+                received += k
+
+                ends = np.flatnonzero(positions == row_frames - 1)
+                times = arrival - (k - 1 - ends) * spacing - self.start_time
+
+                pending = np.concatenate((pending, np.frombuffer(data, dtype=np.uint32)[self.value_mask[positions]]))
+                rows = len(ends)
+                values = pending[0:rows * probes].reshape(rows, probes)
+                pending = pending[rows * probes:]
+
+                if (not self._store(times, values)) or self.stopping:
+                    break
+
+        except Exception as e:
+            self.error = e
+
+        finally:
+            try:
+                pipeline.close()
+            except Exception as e:
+                self.error = e
+
+    def start(self):
+        """
+            Discard any rows held and start sampling in a background thread. The bus must not be used otherwise until sampling has stopped.
+        """
+        if self.thread is not None:
+            raise RuntimeError("Sampler is already running")
+
+        self._clear()
+        self.error = None
+        self.stopping = False
+        self.start_time = time.monotonic()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def wait(self, timeout=None):
+        """
+            Block until sampling stops (a triggered capture is complete) or `timeout` seconds have passed. Returns True if sampling has stopped. Raises the error which stopped sampling, if any.
+
+            Arguments:
+                timeout (float): The maximum time to wait in seconds, or None to wait forever.
+        """
+        if self.thread is None:
+            return True
+
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            return False
+
+        self.thread = None
+        if self.error is not None:
+            raise self.error
+
+        return True
+
+    def stop(self):
+        """
+            Stop sampling, waiting for the responses still in flight. The rows sampled are kept. Raises the error which stopped sampling, if any.
+        """
+        self.stopping = True
+        self.wait()
+
+    @property
+    def running(self):
+        return (self.thread is not None) and self.thread.is_alive()
+
+    def data(self):
+        """
+            Returns a tuple (times, values) of copies of the rows held, oldest first: an array of timestamps in seconds since start(), and a 2D array with one row per sample and one column per probe.
+        """
+        with self.lock:
+            n = len(self)
+            start = (self.count - n) % self.capacity
+            order = (start + np.arange(n)) % self.capacity
+            return self.times[order], self.values[order]
+
+    def trigger_index(self):
+        """
+            Returns the index in data() of the trigger row, or None if the trigger has not fired (or was overwritten).
+        """
+        with self.lock:
+            if self.triggered is None:
+                return None
+
+            index = self.triggered - (self.count - len(self))
+            return index if index >= 0 else None
+
+    def save(self, path):
+        """
+            Store the rows held in the .npy file at `path`, as a structured array with a "time" field (seconds since start()) and a "values" field (one element per probe). Load with numpy.load().
+
+            Arguments:
+                path (str): The file to write.
+        """
+        times, values = self.data()
+        rows = np.zeros(len(times), dtype=[("time", np.float64), ("values", np.uint32, (len(self.addresses),))])
+        rows["time"] = times
+        rows["values"] = values
+        np.save(path, rows)
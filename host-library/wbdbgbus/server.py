@@ -0,0 +1,253 @@
+import os
+import struct
+import socket
+import selectors
+from array import array
+from collections import deque
+from .utils import *
+
+"""
+    Wire protocol between BusServer and RemoteDebugBus (over a Unix socket).
+
+    Request:  header (type, flags, n), followed for MSG_TRANSFER by n 5-byte
+              command frames, starting with an address set. No flags are
+              defined yet (0).
+    Reply:    header (status, n), followed by a payload:
+                - MSG_TRANSFER: n 5-byte response frames
+                - MSG_INFO: (baud, fifo_size)
+                - MSG_INTERRUPTS: 4 interrupt counts and 4 last arrival times
+                  (time.monotonic(), NaN if never received)
+                - any error status: n bytes of UTF-8 error message
+"""
+REQUEST_HEADER = struct.Struct(">BBI")
+REPLY_HEADER = struct.Struct(">BI")
+INFO_PAYLOAD = struct.Struct(">II")
+INTERRUPTS_PAYLOAD = struct.Struct(">4I4d")
+
+MSG_TRANSFER   = 1
+MSG_RESET      = 2
+MSG_INFO       = 3
+MSG_INTERRUPTS = 4
+
+STATUS_OK        = 0
+STATUS_BUS_ERROR = 1
+STATUS_TIMEOUT   = 2
+STATUS_ERROR     = 3
+
+"""
+    Connection state for one client of the server.
+"""
+class _Client:
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.recv_buffer = bytearray()
+        self.requests = deque()
+
+    # Split complete requests off the receive buffer
+    def parse(self):
+        while len(self.recv_buffer) >= REQUEST_HEADER.size:
+            msg, flags, n = REQUEST_HEADER.unpack_from(self.recv_buffer, 0)
+            size = REQUEST_HEADER.size
+            if msg == MSG_TRANSFER:
+                size += n * FRAME_SIZE
+
+            if len(self.recv_buffer) < size:
+                return
+
+            payload = bytes(self.recv_buffer[REQUEST_HEADER.size:size])
+            del self.recv_buffer[0:size]
+            self.requests.append((msg, flags, payload))
+
+    def reply(self, status, payload=b"", n=None):
+        if n is None:
+            n = len(payload)
+
+        self.sock.sendall(REPLY_HEADER.pack(status, n) + payload)
+
+    def error(self, status, message):
+        self.reply(status, str(message).encode("utf-8"))
+
+"""
+    Daemon which owns a DebugBus and shares it between any number of local
+    clients (see RemoteDebugBus) connected over a Unix domain socket. Pending
+    transfers are taken from the clients in round-robin order, at most one per
+    client per round, and all transfers of a round are concatenated into one
+    command stream so they are pipelined through the device's FIFO together.
+"""
+class BusServer:
+
+    def __init__(self, bus, socket_path):
+        self.bus = bus
+        self.socket_path = socket_path
+
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(socket_path)
+        self.listener.listen()
+        self.listener.setblocking(False)
+
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.listener, selectors.EVENT_READ)
+
+        self.clients = []
+        self.running = False
+
+    def _accept(self):
+        sock, _ = self.listener.accept()
+        sock.setblocking(True)
+        client = _Client(sock)
+        self.clients.append(client)
+        self.selector.register(sock, selectors.EVENT_READ, client)
+
+    def _drop(self, client):
+        self.selector.unregister(client.sock)
+        client.sock.close()
+        self.clients.remove(client)
+
+    def _read(self, client):
+        try:
+            data = client.sock.recv(1 << 16)
+        except OSError:
+            data = b""
+
+        if not data:
+            self._drop(client)
+            return
+
+        client.recv_buffer.extend(data)
+        client.parse()
+
+    # Answer requests which do not touch the command stream
+    def _handle_control(self, client, msg):
+        try:
+            if msg == MSG_INFO:
+                client.reply(STATUS_OK, INFO_PAYLOAD.pack(self.bus.baud, self.bus.fifo_size), n=0)
+
+            elif msg == MSG_INTERRUPTS:
+                self.bus.poll_interrupts()
+                times = [float("nan") if t is None else t for t in self.bus.interrupt_times]
+                client.reply(STATUS_OK, INTERRUPTS_PAYLOAD.pack(*(self.bus.interrupt_counts + times)), n=0)
+
+            elif msg == MSG_RESET:
+                self.bus.reset()
+                client.reply(STATUS_OK)
+
+            else:
+                client.error(STATUS_ERROR, "Unknown request type {}".format(msg))
+
+        # Errors from the bus (e.g. noise on the idle line) are reported to
+        # the client and the input is discarded, so the server keeps running
+        except (RuntimeError, TimeoutError) as e:
+            self.bus._discard_input()
+            client.error(self._error_status(e), e)
+
+    # Reply status for an error raised by the bus
+    def _error_status(self, e):
+        if isinstance(e, FramingError):
+            return STATUS_ERROR
+        elif isinstance(e, TimeoutError):
+            return STATUS_TIMEOUT
+        else:
+            return STATUS_BUS_ERROR
+
+    # Next transfer request of `client`, answering any control requests
+    # queued before it. Returns the payload, or None
+    def _next_transfer(self, client):
+        while client.requests:
+            msg, flags, payload = client.requests.popleft()
+            if msg != MSG_TRANSFER:
+                self._handle_control(client, msg)
+                continue
+
+            # Every transfer must set the address, as it may follow any other
+            # client's commands
+            if len(payload) > 0 and (payload[0] & 0x0f) not in (CMD_SET_ADDR, CMD_SET_ADDR_INC):
+                client.error(STATUS_ERROR, "Transfer must start with an address set")
+                continue
+
+            return payload
+
+        return None
+
+    # Select the transfers to run this round
+    def _collect_round(self):
+        candidates = list(self.clients)
+
+        # Rotate so the next round starts with a different client
+        if len(self.clients) > 1:
+            self.clients.append(self.clients.pop(0))
+
+        batch = []
+        for client in candidates:
+            payload = self._next_transfer(client)
+            if payload is not None:
+                batch.append((client, payload))
+
+        return batch
+
+    def _run_round(self):
+        batch = self._collect_round()
+        if not batch:
+            return
+
+        stream = b"".join(payload for client, payload in batch)
+        cmds, words = decode_frames(stream)
+
+        # Bus errors are answered in place of the failed commands' responses,
+        # so they only fail the transfers of the clients which caused them
+        status = STATUS_OK
+        message = None
+        opcodes, data = array("B"), array("I")
+        if len(cmds) > 0:
+            try:
+                opcodes, data = self.bus._transfer(cmds, words, bus_errors=True)
+            except (RuntimeError, TimeoutError) as e:
+                status, message = self._error_status(e), e
+
+            if status != STATUS_OK:
+                self.bus._discard_input()
+
+        pos = 0
+        for client, payload in batch:
+            n = len(payload) // FRAME_SIZE
+            client_status, client_message = status, message
+            if (status == STATUS_OK) and (RESP_BUS_ERROR in opcodes[pos:pos + n]):
+                client_status, client_message = STATUS_BUS_ERROR, "Bus error received"
+
+            try:
+                if client_status == STATUS_OK:
+                    client.reply(STATUS_OK, encode_frames(opcodes[pos:pos + n], data[pos:pos + n]), n=n)
+                else:
+                    client.error(client_status, client_message)
+            except OSError:
+                self._drop(client)
+
+            pos += n
+
+    def serve_forever(self):
+        """
+            Accept clients and serve their requests until close() is called.
+        """
+        self.running = True
+        while self.running:
+            pending = any(c.requests for c in self.clients)
+            for key, events in self.selector.select(0 if pending else 0.1):
+                if key.fileobj is self.listener:
+                    self._accept()
+                else:
+                    self._read(key.data)
+
+            self._run_round()
+
+    def close(self):
+        self.running = False
+        for client in list(self.clients):
+            self._drop(client)
+
+        self.selector.close()
+        self.listener.close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
@@ -0,0 +1,366 @@
+import time
+import mmap
+import struct
+import threading
+from collections import deque
+from .utils import *
+
+"""
+    Wire trace file format. The file is a fixed-size header followed by a
+    circular data area holding records, oldest first from `tail` up to `head`.
+    When the data area is full, the oldest records are overwritten.
+
+    Header: magic, capacity of the data area, head, tail (offsets into the
+            data area).
+    Record: timestamp (time.monotonic_ns()), direction, length, followed by
+            `length` bytes as written to / read from the port. A record never
+            wraps around the end of the data area; a PAD record (or too little
+            space for a record header) marks the rest of the area as unused.
+"""
+TRACE_MAGIC = b"WBTRACE1"
+TRACE_HEADER = struct.Struct("<8sQQQ")
+RECORD_HEADER = struct.Struct("<QBI")
+
+TRACE_TX  = 0
+TRACE_RX  = 1
+TRACE_PAD = 0xFF
+
+"""
+    Records every chunk of bytes sent to and received from a debug bus into a
+    memory-mapped ring-buffered trace file, with monotonic timestamps. Only a
+    copy into the mapping is done per chunk, so recording barely affects the
+    timing of the traced bus.
+"""
+class TraceRecorder:
+
+    def __init__(self, path, capacity=16 << 20):
+        self.path = path
+        self.capacity = capacity
+        self.lock = threading.Lock()
+
+        self.file = open(path, "w+b")
+        self.file.truncate(TRACE_HEADER.size + capacity)
+        self.mm = mmap.mmap(self.file.fileno(), TRACE_HEADER.size + capacity)
+
+        self.head = 0
+        self.tail = 0
+        self.records = 0
+        self._sync()
+
+    def _sync(self):
+        TRACE_HEADER.pack_into(self.mm, 0, TRACE_MAGIC, self.capacity, self.head, self.tail)
+
+    # Drop the oldest records until none start within [start, end)
+    def _free(self, start, end):
+        while (self.records > 0) and (start <= self.tail < end):
+            # Unused space at the end of the area
+            if self.tail + RECORD_HEADER.size > self.capacity:
+                self.tail = 0
+                continue
+
+            t, direction, n = RECORD_HEADER.unpack_from(self.mm, TRACE_HEADER.size + self.tail)
+            if direction == TRACE_PAD:
+                self.tail = 0
+                continue
+
+            self.tail += RECORD_HEADER.size + n
+            self.records -= 1
+            if self.tail == self.capacity:
+                self.tail = 0
+
+        if self.records == 0:
+            self.tail = self.head
+
+    def _append(self, timestamp, direction, data):
+        size = RECORD_HEADER.size + len(data)
+
+        if self.head + size > self.capacity:
+            # Does not fit before the end of the area, so start again at 0
+            self._free(self.head, self.capacity)
+            if self.head + RECORD_HEADER.size <= self.capacity:
+                RECORD_HEADER.pack_into(self.mm, TRACE_HEADER.size + self.head, 0, TRACE_PAD, 0)
+
+            self.head = 0
+            if self.records == 0:
+                self.tail = 0
+
+        # Keep the tail out of the new record, so head == tail only when empty
+        self._free(self.head, self.head + size + 1)
+
+        pos = TRACE_HEADER.size + self.head
+        RECORD_HEADER.pack_into(self.mm, pos, timestamp, direction, len(data))
+        self.mm[pos + RECORD_HEADER.size:pos + size] = data
+        self.head += size
+        self.records += 1
+
+    def record(self, direction, data):
+        """
+            Append a chunk of bytes sent (TRACE_TX) or received (TRACE_RX).
+
+            Arguments:
+                direction (int): TRACE_TX or TRACE_RX.
+                data (bytes): The bytes sent or received.
+        """
+        if len(data) == 0:
+            return
+
+        timestamp = time.monotonic_ns()
+
+        # Records are kept well below the capacity
+        limit = self.capacity // 4 - RECORD_HEADER.size
+        with self.lock:
+            for i in range(0, len(data), limit):
+                self._append(timestamp, direction, data[i:i + limit])
+            self._sync()
+
+    def close(self):
+        with self.lock:
+            if self.mm is None:
+                return
+
+            self._sync()
+            self.mm.flush()
+            self.mm.close()
+            self.file.close()
+            self.mm = None
+
+    # Context manager compliance
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
+
+"""
+    Read the records of a trace file written by TraceRecorder, oldest first.
+    Yields (timestamp_ns, direction, data) tuples.
+"""
+def read_trace(path):
+    with open(path, "rb") as f:
+        data = f.read()
+
+    magic, capacity, head, tail = TRACE_HEADER.unpack_from(data, 0)
+    if magic != TRACE_MAGIC:
+        raise ValueError("Not a wbdbgbus trace file: {}".format(path))
+
+    area = memoryview(data)[TRACE_HEADER.size:TRACE_HEADER.size + capacity]
+
+    pos = tail
+    while pos != head:
+        if pos + RECORD_HEADER.size > capacity:
+            pos = 0
+            continue
+
+        timestamp, direction, n = RECORD_HEADER.unpack_from(area, pos)
+        if direction == TRACE_PAD:
+            pos = 0
+            continue
+
+        start = pos + RECORD_HEADER.size
+        yield timestamp, direction, bytes(area[start:start + n])
+        pos = start + n
+
+"""
+    One decoded bus operation: a run of consecutive reads or writes, a bus
+    reset, an interrupt or an unanswered command. `address` and `increment`
+    give the bus addresses accessed, `values` the data read or written.
+    `sent` and `done` are the timestamps (in nanoseconds) at which the first
+    command was sent and the last response was received.
+"""
+class TraceOp:
+
+    def __init__(self, kind, address=None, increment=True, sent=None, done=None):
+        self.kind = kind
+        self.address = address
+        self.increment = increment
+        self.values = []
+        self.sent = sent
+        self.done = done
+        self.error = False
+
+    # Next address this operation would access if extended
+    def next_address(self):
+        step = len(self.values) if self.increment else 0
+        return (self.address + step) & 0xffffffff
+
+    def __str__(self):
+        t = "{:.6f}".format(self.sent / 1e9) if self.sent is not None else "?"
+        if self.done is not None and self.sent is not None:
+            t += " +{:.3f} ms".format((self.done - self.sent) / 1e6)
+
+        if self.kind in ("read", "write"):
+            values = " ".join("{:08x}".format(v) for v in self.values[:8])
+            if len(self.values) > 8:
+                values += " ... ({} words)".format(len(self.values))
+
+            return "{} {:<6} {:08x}{} {}{}".format(
+                t, self.kind, self.address, "" if self.increment else " (pipe)",
+                values, " BUS ERROR" if self.error else ""
+            )
+
+        return "{} {}".format(t, self.kind)
+
+"""
+    Decode trace records (as yielded by read_trace()) into bus operations.
+    Command and response frames are matched up in order, consecutive reads or
+    writes of adjacent addresses are merged, and interrupts and resets are
+    reported as they occur. Yields TraceOp objects in order of completion.
+    Once a trace has wrapped around, the responses at its start may belong to
+    overwritten commands, so the first few operations may be misattributed.
+"""
+def decode_trace(records):
+    tx = bytearray()
+    rx = bytearray()
+    pending = deque() # (opcode, word, timestamp) of commands awaiting response
+
+    address = None
+    increment = True
+    op = None
+
+    def complete(kind, word, sent, done, error=False):
+        nonlocal address, op
+        out = []
+
+        if (op is not None) and ((op.kind != kind) or (op.increment != increment) or
+                                 (op.next_address() != address) or op.error):
+            out.append(op)
+            op = None
+
+        if op is None:
+            op = TraceOp(kind, address, increment, sent)
+
+        op.values.append(word)
+        op.done = done
+        op.error = error
+
+        if increment:
+            address = (address + 1) & 0xffffffff
+
+        return out
+
+    def flush():
+        nonlocal op
+        out = [] if op is None else [op]
+        op = None
+        return out
+
+    for timestamp, direction, data in records:
+        if direction == TRACE_TX:
+            tx.extend(data)
+            n = len(tx) // FRAME_SIZE
+            opcodes, words = decode_frames(bytes(tx[0:n * FRAME_SIZE]))
+            del tx[0:n * FRAME_SIZE]
+
+            for opcode, word in zip(opcodes, words):
+                pending.append((opcode & 0x0f, word, timestamp))
+            continue
+
+        rx.extend(data)
+        n = len(rx) // FRAME_SIZE
+        opcodes, words = decode_frames(bytes(rx[0:n * FRAME_SIZE]))
+        del rx[0:n * FRAME_SIZE]
+
+        for opcode, word in zip(opcodes, words):
+            if opcode in RESP_INTERRUPT_ALL:
+                yield from flush()
+                yield TraceOp("interrupt {}".format(RESP_INTERRUPT_ALL.index(opcode) + 1), sent=timestamp)
+                continue
+
+            if opcode == RESP_BUS_RESET:
+                # Everything sent before the reset is dropped by the device
+                yield from flush()
+                sent = timestamp
+                while pending:
+                    cmd, cmd_word, sent = pending.popleft()
+                    if cmd == CMD_BUS_RESET:
+                        break
+
+                yield TraceOp("reset", sent=sent, done=timestamp)
+                address = None
+                continue
+
+            if not pending:
+                yield from flush()
+                yield TraceOp("unexpected response {}".format(opcode), sent=timestamp)
+                continue
+
+            cmd, cmd_word, sent = pending.popleft()
+            error = opcode == RESP_BUS_ERROR
+
+            if cmd in (CMD_SET_ADDR, CMD_SET_ADDR_INC):
+                yield from flush()
+                address = cmd_word
+                increment = cmd == CMD_SET_ADDR_INC
+
+            elif (cmd == CMD_READ_REQ) and (address is not None):
+                yield from complete("read", 0 if error else word, sent, timestamp, error)
+
+            elif (cmd == CMD_WRITE_REQ) and (address is not None):
+                yield from complete("write", cmd_word, sent, timestamp, error)
+
+    yield from flush()
+
+    # Commands still waiting for a response when the trace ends
+    for cmd, word, sent in pending:
+        yield TraceOp("unanswered command {} ({:08x})".format(cmd, word), sent=sent)
+
+"""
+    Port-like object which plays back the bytes received in a trace file, for
+    reproducing a recorded session offline (pass it to DebugBus in place of
+    a serial port name). Each recorded chunk of received bytes is only made
+    available once the bus has written as many bytes as had been sent when it
+    was recorded, so responses never arrive ahead of their commands. With
+    `verify`, the bytes written must match the recorded transmit stream.
+"""
+class ReplayPort:
+
+    def __init__(self, path, verify=False):
+        self.verify = verify
+        self.timeout = 0
+
+        # Transmit stream and (bytes sent beforehand, received chunk) pairs
+        self.tx = bytearray()
+        self.chunks = deque()
+        for timestamp, direction, data in read_trace(path):
+            if direction == TRACE_TX:
+                self.tx.extend(data)
+            else:
+                self.chunks.append((len(self.tx), data))
+
+        self.written = 0
+        self.available = bytearray()
+
+    def _release(self):
+        while self.chunks and (self.chunks[0][0] <= self.written):
+            self.available.extend(self.chunks.popleft()[1])
+
+    @property
+    def in_waiting(self):
+        self._release()
+        return len(self.available)
+
+    def write(self, data):
+        data = bytes(data)
+        if self.verify:
+            expected = bytes(self.tx[self.written:self.written + len(data)])
+            if data != expected:
+                raise ValueError("Transmitted data diverges from the trace at byte {}".format(self.written))
+
+        self.written += len(data)
+        return len(data)
+
+    def read(self, size=1):
+        self._release()
+
+        # A blocking read of nothing would never return
+        if (not self.available) and (self.timeout != 0):
+            if self.chunks:
+                raise EOFError("Trace has no more received data before the next transmission")
+            raise EOFError("End of trace")
+
+        data = bytes(self.available[0:size])
+        del self.available[0:size]
+        return data
+
+    def close(self):
+        pass
@@ -0,0 +1,167 @@
+from array import array
+from .utils import *
+
+"""
+    Deferred result of an operation queued in a Transaction. The value becomes
+    available once the transaction has been executed.
+"""
+class Result:
+
+    def __init__(self):
+        self.done = False
+        self._value = None
+
+    @property
+    def value(self):
+        if not self.done:
+            raise RuntimeError("Transaction has not been executed yet")
+
+        return self._value
+
+    def _set(self, value):
+        self._value = value
+        self.done = True
+
+    def __repr__(self):
+        if not self.done:
+            return "Result(<pending>)"
+
+        return "Result({!r})".format(self._value)
+
+"""
+    Queue of mixed bus operations which is compiled into one command stream
+    and pipelined through the debug bus in a single transfer. Address sets are
+    left out wherever the device's address pointer already lines up with the
+    next operation (e.g. consecutive writes to adjacent registers).
+"""
+class Transaction:
+
+    def __init__(self, bus):
+        self.bus = bus
+        self.ops = []
+
+    def _queue(self, cmd, address, data, increment):
+        result = Result()
+        self.ops.append((cmd, address, data, increment, result))
+        return result
+
+    def read(self, address, n=1):
+        """
+            Queue a read of `n` contiguous 32-bit words starting at `address`. Returns a Result whose value will be a list of `n` integers.
+
+            Arguments:
+                address (int): The base address to read from.
+                n (int): The number of values to read starting at the given address.
+        """
+        return self._queue(CMD_READ_REQ, address, n, True)
+
+    def read_peripheral(self, address, n=1):
+        """
+            Queue `n` reads, all from `address`. Returns a Result whose value will be a list of `n` integers.
+
+            Arguments:
+                address (int): The singular address to read from.
+                n (int): The number of values to read from the given address.
+        """
+        return self._queue(CMD_READ_REQ, address, n, False)
+
+    def write(self, address, data):
+        """
+            Queue a write of `data` into contiguous 32-bit words starting at `address`. `None` values in the data array will not be written. Returns a Result whose value will be None.
+
+            Arguments:
+                address (int): The base address to write to.
+                data (list[int] OR int): The data to write.
+        """
+        if isinstance(data, int):
+            data = [data]
+
+        return self._queue(CMD_WRITE_REQ, address, list(data), True)
+
+    def write_peripheral(self, address, data):
+        """
+            Queue writes of all values in `data` to `address`. Returns a Result whose value will be None.
+
+            Arguments:
+                address (int): The singular address to write to.
+                data (list[int] OR int): The data to write to the address.
+        """
+        if isinstance(data, int):
+            data = [data]
+
+        assert None not in data
+        return self._queue(CMD_WRITE_REQ, address, list(data), False)
+
+    def compile(self):
+        """
+            Compile the queued operations into a command stream. Returns (opcodes, words, spans), where spans holds the (start, count) of each operation's responses within the stream.
+        """
+        cmds = bytearray()
+        words = array("I")
+        spans = []
+
+        # Address pointer state of the device, None until known
+        cur_addr = None
+        cur_inc = None
+
+        for cmd, address, data, increment, result in self.ops:
+            n = data if cmd == CMD_READ_REQ else len(data)
+
+            if (cur_addr != address) or (cur_inc != increment):
+                cmds.append(CMD_SET_ADDR_INC if increment else CMD_SET_ADDR)
+                words.append(address)
+
+            spans.append((len(cmds), n))
+
+            if cmd == CMD_READ_REQ:
+                cmds.extend(bytes([CMD_READ_REQ]) * n)
+                words.frombytes(bytes(4 * n))
+            else:
+                # Use read req to increment address w/o writing
+                if None in data:
+                    assert increment
+                cmds.extend(CMD_READ_REQ if x is None else CMD_WRITE_REQ for x in data)
+                words.extend(0 if x is None else (x & 0xffffffff) for x in data)
+
+            cur_addr = ((address + n) & 0xffffffff) if increment else address
+            cur_inc = increment
+
+        return bytes(cmds), words, spans
+
+    def execute(self):
+        """
+            Send all queued operations to the bus and fill in their results. Blocks execution until finished or timed out.
+        """
+        if len(self.ops) == 0:
+            return
+
+        cmds, words, spans = self.compile()
+        opcodes, data = self.bus._transfer(cmds, words, "batch")
+
+        assert opcodes.tobytes() == expected_responses(cmds)
+
+        cache = self.bus.cache
+        for (cmd, address, op_data, increment, result), (start, n) in zip(self.ops, spans):
+            if cmd == CMD_READ_REQ:
+                result._set(data[start:start + n].tolist())
+            else:
+                result._set(None)
+
+            # Keep the bus's register shadow coherent
+            if cache is not None:
+                if not increment:
+                    cache.invalidate(address)
+                elif cmd == CMD_READ_REQ:
+                    cache.fill(address, result.value)
+                else:
+                    cache.written(address, op_data)
+
+        self.ops = []
+
+    # Context manager compliance
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        if exception_type is None:
+            self.execute()
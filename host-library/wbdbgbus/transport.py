@@ -0,0 +1,157 @@
+import time
+import socket
+import select
+import threading
+from serial import Serial, serial_for_url
+from .model import DeviceModel
+
+# Transports are port-like objects providing the subset of the pyserial
+# interface used by DebugBus: read(size), write(data), close(), the
+# `in_waiting` property and a `timeout` attribute (0 = non-blocking reads,
+# None = block until `size` bytes arrive, otherwise a limit in seconds).
+# Transports with a pollable handle also provide fileno().
+
+"""
+    Transport over a raw TCP connection, e.g. to a ser2net port or a
+    UART-to-network bridge. Nagle's algorithm is disabled and the socket
+    buffers enlarged, so each window of commands leaves in one segment as
+    soon as it is written.
+"""
+class TcpTransport:
+
+    def __init__(self, host, port, connect_timeout=5, buffer_size=1 << 20):
+        self.sock = socket.create_connection((host, port), timeout=connect_timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, buffer_size)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, buffer_size)
+        self.sock.settimeout(None)
+
+        self.timeout = 0
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    @property
+    def in_waiting(self):
+        if not select.select([self.sock], [], [], 0)[0]:
+            return 0
+
+        data = self.sock.recv(1 << 16, socket.MSG_PEEK)
+        if not data:
+            raise ConnectionError("Connection closed by remote end")
+        return len(data)
+
+    def write(self, data):
+        self.sock.sendall(data)
+        return len(data)
+
+    def read(self, size=1):
+        deadline = None
+        if self.timeout is not None:
+            deadline = time.monotonic() + self.timeout
+
+        data = bytearray()
+        while len(data) < size:
+            wait = None if deadline is None else max(0, deadline - time.monotonic())
+            if not select.select([self.sock], [], [], wait)[0]:
+                break
+
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("Connection closed by remote end")
+            data.extend(chunk)
+
+            # Non-blocking reads return whatever was available
+            if self.timeout == 0:
+                break
+
+        return bytes(data)
+
+    def close(self):
+        self.sock.close()
+
+"""
+    Transport connected directly to an in-process device model (by default a
+    DeviceModel), without any I/O. Written commands are handed to the model's
+    receive() and its responses become readable as soon as the model
+    transmits them (immediately for a DeviceModel, at the emulated UART rate
+    for an Emulator), so the host side can be exercised and its throughput
+    measured without hardware. A socket pair signals pending responses, so
+    the transport can be polled like a real port (e.g. by AsyncDebugBus).
+"""
+class LoopbackTransport:
+
+    def __init__(self, model=None):
+        self.buffer = bytearray()
+        self.cond = threading.Condition()
+        self.timeout = 0
+
+        # Readable (holding one byte) whenever the buffer is not empty
+        self.signal_recv, self.signal_send = socket.socketpair()
+        self.signal_recv.setblocking(False)
+        self.signalled = False
+
+        self.model = DeviceModel() if model is None else model
+        self.model.transmit = self._deliver
+
+    # Called by the model with bytes to send to the host
+    def _deliver(self, data):
+        with self.cond:
+            self.buffer.extend(data)
+            if self.buffer and not self.signalled:
+                self.signal_send.send(b"\0")
+                self.signalled = True
+            self.cond.notify_all()
+
+    def fileno(self):
+        return self.signal_recv.fileno()
+
+    @property
+    def in_waiting(self):
+        return len(self.buffer)
+
+    def write(self, data):
+        self.model.receive(bytes(data))
+        return len(data)
+
+    def read(self, size=1):
+        with self.cond:
+            if self.timeout != 0:
+                self.cond.wait_for(lambda: len(self.buffer) >= size, self.timeout)
+
+            data = bytes(self.buffer[0:size])
+            del self.buffer[0:size]
+
+            if self.signalled and not self.buffer:
+                self.signal_recv.recv(1)
+                self.signalled = False
+
+        return data
+
+    def close(self):
+        self.model.close()
+        self.signal_recv.close()
+        self.signal_send.close()
+
+"""
+    Open the transport for `url`:
+        - "tcp://host:port" opens a TcpTransport
+        - "loopback://" opens a LoopbackTransport to a new DeviceModel
+        - other URLs ("scheme://...") are opened with pyserial's
+          serial_for_url()
+        - anything else is the device name of a serial port
+"""
+def open_transport(url, baud):
+    if url.startswith("tcp://"):
+        host, _, port = url[len("tcp://"):].rpartition(":")
+        return TcpTransport(host.strip("[]"), int(port))
+
+    if url.startswith("loopback://"):
+        return LoopbackTransport()
+
+    # No timeout for serial port
+    # Instead, use unblocking serial port and block internally
+    if "://" in url:
+        return serial_for_url(url, baud, timeout=0)
+
+    return Serial(url, baud, timeout=0)
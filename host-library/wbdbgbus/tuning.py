@@ -0,0 +1,161 @@
+import os
+import json
+import math
+from collections import deque
+
+"""
+    Pipelining parameters of a DebugBus and, in adaptive mode, their online
+    tuning from the measured link behaviour.
+
+    `window` is the number of commands kept in flight (never more than the
+    FIFO allows), and `min_write` the number of free window slots to collect
+    before topping the window up, so larger values mean fewer, larger port
+    writes and fewer wakeups per word. `min_write` is derived from the
+    bandwidth-delay product of the link: the median recently measured
+    round-trip time (from sending a window into an idle pipeline to its first
+    response) times the highest recently measured response rate. It is as
+    large as possible while still leaving twice the bandwidth-delay product
+    in flight when the window is topped up, so the link never runs dry.
+
+    A timeout halves the window, which then grows back by one command per
+    successful transfer, so a device which drops commands (e.g. when its
+    FIFO overruns behind a stalled bus) is backed off from.
+"""
+class Tuner:
+
+    # Number of recent samples the round-trip time and rate estimates use
+    RTT_SAMPLES = 64
+    RATE_SAMPLES = 16
+
+    # Commands left in flight when topping up, relative to the
+    # bandwidth-delay product
+    HEADROOM = 2.0
+
+    def __init__(self, max_window, adaptive=False):
+        self.max_window = max_window
+        self.adaptive = adaptive
+
+        self.window = max_window
+        self.min_write = 1
+
+        # Estimates: seconds, and responses per second
+        self.rtt = None
+        self.rate = None
+        self.rtt_samples = deque(maxlen=self.RTT_SAMPLES)
+        self.rate_samples = deque(maxlen=self.RATE_SAMPLES)
+
+    # Record the time from sending a window into an idle pipeline until its
+    # first response
+    def sample_rtt(self, seconds):
+        self.rtt_samples.append(seconds)
+
+    # Record a finished transfer, in which `frames` responses after the
+    # first arrived over `seconds`
+    def end_transfer(self, frames, seconds):
+        if not self.adaptive:
+            return
+
+        if (frames > 0) and (seconds > 0):
+            self.rate_samples.append(frames / seconds)
+
+        if self.window < self.max_window:
+            self.window += 1
+
+        self._retune()
+
+    # Record a transfer which timed out
+    def timeout(self):
+        if not self.adaptive:
+            return
+
+        self.window = max(1, self.window // 2)
+        self._retune()
+
+    def bandwidth_delay(self):
+        """
+            Returns the estimated number of responses in flight on the link (round-trip time times response rate), or None until both have been measured.
+        """
+        if (self.rtt is None) or (self.rate is None):
+            return None
+
+        return self.rtt * self.rate
+
+    def _retune(self):
+        if self.rtt_samples:
+            self.rtt = sorted(self.rtt_samples)[len(self.rtt_samples) // 2]
+        if self.rate_samples:
+            self.rate = max(self.rate_samples)
+
+        bdp = self.bandwidth_delay()
+        if bdp is None:
+            self.min_write = 1
+            return
+
+        self.min_write = max(1, min(self.window, self.window - math.ceil(self.HEADROOM * bdp)))
+
+    def parameters(self):
+        """
+            Returns the tuned parameters as a dictionary (suitable for JSON).
+        """
+        return {
+            "window": self.window,
+            "min_write": self.min_write,
+            "rtt": self.rtt,
+            "rate": self.rate,
+        }
+
+    def apply(self, parameters):
+        """
+            Use previously tuned parameters (as returned by parameters()). The window is still limited by the FIFO size. In adaptive mode, tuning continues from these values.
+
+            Arguments:
+                parameters (dict): The parameters to use.
+        """
+        self.window = max(1, min(parameters["window"], self.max_window))
+        self.min_write = max(1, min(parameters["min_write"], self.window))
+
+        self.rtt = parameters.get("rtt")
+        self.rate = parameters.get("rate")
+        self.rtt_samples.clear()
+        self.rate_samples.clear()
+        if self.rtt is not None:
+            self.rtt_samples.append(self.rtt)
+        if self.rate is not None:
+            self.rate_samples.append(self.rate)
+
+    def save(self, path, board="default"):
+        """
+            Store the tuned parameters in the JSON file at `path` under the name `board`, keeping the entries of other boards.
+
+            Arguments:
+                path (str): The file to write.
+                board (str): The name to store the parameters under.
+        """
+        entries = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                entries = json.load(f)
+
+        entries[board] = self.parameters()
+        with open(path, "w") as f:
+            json.dump(entries, f, indent=2)
+
+    def load(self, path, board="default"):
+        """
+            Use the parameters stored with save() under the name `board`. Returns False (leaving the parameters unchanged) if there are none.
+
+            Arguments:
+                path (str): The file to read.
+                board (str): The name the parameters were stored under.
+        """
+        if not os.path.exists(path):
+            return False
+
+        with open(path) as f:
+            entries = json.load(f)
+
+        if board not in entries:
+            return False
+
+        self.apply(entries[board])
+        return True
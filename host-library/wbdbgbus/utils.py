@@ -1,3 +1,8 @@
+import re
+import struct
+import sys
+from array import array
+
 CMD_READ_REQ     = 0b0001
 CMD_WRITE_REQ    = 0b0010
 CMD_SET_ADDR     = 0b0011
@@ -17,21 +22,197 @@ RESP_INTERRUPT_4 = 0b1011
 RESP_INTERRUPT_ALL = [RESP_INTERRUPT_1, RESP_INTERRUPT_2,
                       RESP_INTERRUPT_3, RESP_INTERRUPT_4]
 
+# Responses which are handled by the receive path rather than queued
+RESP_SPECIAL = RESP_INTERRUPT_ALL + [RESP_BUS_ERROR]
+
+FRAME_SIZE = 5
+FRAME_STRUCT = struct.Struct(">BI")
+
+# Clears the don't-care upper nibble of an opcode byte
+OPCODE_MASK = bytes(x & 0x0f for x in range(256))
+
+# Response expected for each command opcode
+EXPECTED_RESPONSE = bytearray(256)
+EXPECTED_RESPONSE[CMD_READ_REQ] = RESP_READ_RESP
+EXPECTED_RESPONSE[CMD_WRITE_REQ] = RESP_WRITE_ACK
+EXPECTED_RESPONSE[CMD_SET_ADDR] = RESP_ADDR_ACK
+EXPECTED_RESPONSE[CMD_SET_ADDR_INC] = RESP_ADDR_ACK
+EXPECTED_RESPONSE = bytes(EXPECTED_RESPONSE)
+
+# First bytes of the frames the device can send (it always sends the upper
+# nibble as 0); all but read responses carry a zero data word
+VALID_RESPONSE_BYTES = bytes([RESP_READ_RESP, RESP_WRITE_ACK, RESP_ADDR_ACK, RESP_BUS_ERROR,
+                              RESP_BUS_RESET] + RESP_INTERRUPT_ALL)
+INVALID_RESPONSE_RE = re.compile(b"[^" + re.escape(VALID_RESPONSE_BYTES) + b"]")
+NON_READ_RESPONSE_RE = re.compile(b"[^" + re.escape(bytes([RESP_READ_RESP])) + b"]")
+
+# Opcodes of the commands which set the address register
+ADDR_SET_RE = re.compile(b"[" + re.escape(bytes([CMD_SET_ADDR, CMD_SET_ADDR_INC])) + b"]")
+
+# Response to a bus reset, which can only appear in the received byte
+# stream on a frame boundary
+RESET_FRAME = bytes([RESP_BUS_RESET, 0, 0, 0, 0])
+
+"""
+    Raised when the received bytes cannot be split into the response frames
+    the device sends, e.g. after a byte was lost or corrupted on the line.
+"""
+class FramingError(RuntimeError):
+    pass
+
 """
     Converts a 4-bit instruction and a 32-bit data word into 5 8-bit packets
 """
 def create_instruction(inst, data):
-    return [
-        inst,
-        (data & 0xff000000) >> 24,
-        (data & 0x00ff0000) >> 16,
-        (data & 0x0000ff00) >> 8,
-        (data & 0x000000ff) >> 0
-    ]
+    return list(FRAME_STRUCT.pack(inst, data & 0xFFFFFFFF))
 
 """
     Converts 5 8-bit packets into a 4-bit instruction and 32-bit data word
 """
 def parse_instruction(byte_list):
-    data = int("".join(["{0:08b}".format(x) for x in byte_list[1:]]), 2)
-    return byte_list[0] & 0x0f, data
+    inst, data = FRAME_STRUCT.unpack(bytes(byte_list[0:FRAME_SIZE]))
+    return inst & 0x0f, data
+
+"""
+    Encodes a batch of instructions into one contiguous byte string. `opcodes`
+    is either a single opcode shared by every frame or a sequence with one
+    opcode per word. Frames are assembled with strided slice assignment, so
+    the per-word work happens in C rather than in the interpreter.
+"""
+def encode_frames(opcodes, words):
+    if isinstance(words, memoryview):
+        view = words
+        words = array("I")
+        words.frombytes(view.cast("B"))
+    else:
+        try:
+            words = array("I", words)
+        except OverflowError:
+            # Words are truncated to 32 bits (negative words as two's complement)
+            words = array("I", [word & 0xFFFFFFFF for word in words])
+    n = len(words)
+
+    if sys.byteorder == "little":
+        words.byteswap()
+    raw = words.tobytes()
+
+    out = bytearray(FRAME_SIZE * n)
+    if isinstance(opcodes, int):
+        out[0::FRAME_SIZE] = bytes([opcodes]) * n
+    else:
+        out[0::FRAME_SIZE] = bytes(opcodes)
+
+    for i in range(4):
+        out[i + 1::FRAME_SIZE] = raw[i::4]
+
+    return bytes(out)
+
+"""
+    Decodes every complete frame in `buf`. Returns (opcode_array, data_array)
+    as an array('B') of 4-bit opcodes and an array('I') of 32-bit data words.
+"""
+def decode_frames(buf):
+    buf = bytes(buf)
+    n = len(buf) // FRAME_SIZE
+    end = n * FRAME_SIZE
+
+    opcodes = array("B", buf[0:end:FRAME_SIZE].translate(OPCODE_MASK))
+
+    raw = bytearray(4 * n)
+    for i in range(4):
+        raw[i::4] = buf[i + 1:end:FRAME_SIZE]
+
+    data = array("I")
+    data.frombytes(raw)
+    if sys.byteorder == "little":
+        data.byteswap()
+
+    return opcodes, data
+
+"""
+    Returns the index of the first complete frame in `buf` which the device
+    cannot have sent (an invalid first byte, or a non-zero data word in a
+    response other than a read response), or -1 if all of them are valid.
+"""
+def find_invalid_frame(buf):
+    buf = bytes(buf)
+    n = len(buf) // FRAME_SIZE
+    first = buf[0:n * FRAME_SIZE:FRAME_SIZE]
+
+    match = INVALID_RESPONSE_RE.search(first)
+    end = n if match is None else match.start()
+
+    # With no read responses, every data byte must be zero (the first bytes
+    # are all non-zero), so the per-frame check is only needed on a failure
+    fast = (first.count(RESP_READ_RESP, 0, end) == 0) and \
+           (buf.count(0, 0, end * FRAME_SIZE) == 4 * end)
+
+    if not fast:
+        for m in NON_READ_RESPONSE_RE.finditer(first, 0, end):
+            i = m.start() * FRAME_SIZE
+            if buf[i + 1:i + FRAME_SIZE] != bytes(4):
+                return m.start()
+
+    return -1 if match is None else end
+
+"""
+    Returns a flat memoryview of 32-bit words over `buf`, which may be any
+    C-contiguous buffer of native-endian 32-bit unsigned integers (such as an
+    array('I') or a NumPy uint32 array) or of raw bytes (such as a bytearray).
+"""
+def word_view(buf):
+    view = memoryview(buf)
+    native = "<" if sys.byteorder == "little" else ">"
+
+    if view.format in ("B", "b", "c"):
+        if view.nbytes % 4 != 0:
+            raise ValueError("Buffer length must be a multiple of 4 bytes")
+    elif (view.itemsize != 4) or (view.format.lstrip("@=" + native) not in ("I", "L")):
+        raise ValueError("Buffer must hold native-endian 32-bit unsigned words, "
+                         "got format '{}'".format(view.format))
+
+    return view.cast("B").cast("I")
+
+"""
+    Builds the command stream for reading `n` words starting at `address`: an
+    address set followed by one read request per word. Returns (opcodes, words).
+"""
+def read_commands(address, n, increment=True):
+    cmds = bytes([CMD_SET_ADDR_INC if increment else CMD_SET_ADDR])
+    cmds += bytes([CMD_READ_REQ]) * n
+    words = array("I", [address])
+    words.frombytes(bytes(4 * n))
+    return cmds, words
+
+"""
+    Builds the command stream for writing `data` starting at `address`: an
+    address set followed by one write request per word. `None` entries become
+    read requests, which step the address without writing. Returns
+    (opcodes, words).
+"""
+def write_commands(address, data, increment=True):
+    cmds = bytes([CMD_SET_ADDR_INC if increment else CMD_SET_ADDR])
+    cmds += bytes(CMD_READ_REQ if x is None else CMD_WRITE_REQ for x in data)
+    words = [address] + [0 if x is None else x for x in data]
+    return cmds, words
+
+"""
+    Returns the response opcodes (as bytes) which a successful run of the
+    command stream `cmds` produces.
+"""
+def expected_responses(cmds):
+    return bytes(cmds).translate(EXPECTED_RESPONSE)
+
+"""
+    Groups addresses into runs of consecutive addresses. Duplicates are merged.
+    Returns a sorted list of (base_address, count).
+"""
+def address_runs(addresses):
+    runs = []
+    for address in sorted(set(addresses)):
+        if runs and (runs[-1][0] + runs[-1][1] == address):
+            runs[-1][1] += 1
+        else:
+            runs.append([address, 1])
+
+    return [(base, count) for base, count in runs]